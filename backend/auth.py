@@ -3,13 +3,57 @@ Authentication middleware for FastAPI.
 Verifies Supabase JWT tokens and extracts user role.
 """
 
+import hashlib
+
+import jwt
 from fastapi import HTTPException, Depends, Header
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from typing import Optional
-from config import get_supabase_admin_client
+from cachetools import TTLCache
+from config import get_supabase_admin_client, get_settings
 
 security = HTTPBearer()
 
+# Process-local cache of resolved users keyed by a hash of the bearer token.
+# Short TTL so role changes / revocations still propagate quickly.
+_user_cache: TTLCache = TTLCache(maxsize=10000, ttl=30)
+
+
+def _cache_key(token: str) -> str:
+    """Hash the token so raw JWTs are never kept in memory as cache keys."""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _user_from_claims(token: str) -> Optional["AuthenticatedUser"]:
+    """
+    Resolve the user purely from the JWT when possible.
+    The sync_role_claim trigger bakes the role into app_metadata, so a
+    locally verified token needs no database call at all. Returns None
+    when the secret is unconfigured, the token is invalid, or the role
+    claim is absent (legacy tokens) — callers then fall back to the RPC.
+    """
+    secret = get_settings().SUPABASE_JWT_SECRET
+    if not secret:
+        return None
+
+    try:
+        payload = jwt.decode(
+            token, secret, algorithms=["HS256"], audience="authenticated"
+        )
+    except jwt.PyJWTError:
+        return None
+
+    role = (payload.get("app_metadata") or {}).get("role")
+    if not role:
+        return None
+
+    return AuthenticatedUser(
+        user_id=str(payload["sub"]),
+        email=payload.get("email", ""),
+        role=role
+    )
+
 
 class AuthenticatedUser:
     """Represents an authenticated user from Supabase."""
@@ -29,35 +73,44 @@ async def get_current_user(
 ) -> AuthenticatedUser:
     """
     Dependency to get the current authenticated user.
-    Validates JWT token and fetches user role from profiles.
+    Validates the JWT and resolves id, email and role in one call.
+    Users without a profile row default to the 'student' role.
     """
     token = credentials.credentials
-    
+
+    cache_key = _cache_key(token)
+    cached_user = _user_cache.get(cache_key)
+    if cached_user is not None:
+        return cached_user
+
+    # Fast path: role baked into the JWT claims, no network I/O needed
+    claims_user = _user_from_claims(token)
+    if claims_user is not None:
+        _user_cache[cache_key] = claims_user
+        return claims_user
+
     try:
         supabase = get_supabase_admin_client()
-        
-        # Verify the JWT token and get user
-        user_response = supabase.auth.get_user(token)
-        
-        if not user_response or not user_response.user:
+
+        # Verify the JWT and fetch the joined profile in one round trip.
+        # The Supabase client is synchronous, so run it off the event loop.
+        response = await run_in_threadpool(
+            supabase.rpc("get_user_with_profile", {"jwt": token}).execute
+        )
+
+        if not response.data:
             raise HTTPException(status_code=401, detail="Invalid or expired token")
-        
-        user = user_response.user
-        
-        # Get user role from profiles table
-        profile_response = supabase.table("profiles").select("role").eq("id", user.id).single().execute()
-        
-        if not profile_response.data:
-            raise HTTPException(status_code=404, detail="User profile not found")
-        
-        role = profile_response.data.get("role", "student")
-        
-        return AuthenticatedUser(
-            user_id=str(user.id),
-            email=user.email,
-            role=role
+
+        data = response.data
+
+        authenticated_user = AuthenticatedUser(
+            user_id=str(data["id"]),
+            email=data["email"],
+            role=data.get("role", "student")
         )
-        
+        _user_cache[cache_key] = authenticated_user
+        return authenticated_user
+
     except HTTPException:
         raise
     except Exception as e:
@@ -91,22 +144,33 @@ async def get_optional_user(
     
     try:
         token = authorization.replace("Bearer ", "")
+
+        cache_key = _cache_key(token)
+        cached_user = _user_cache.get(cache_key)
+        if cached_user is not None:
+            return cached_user
+
+        claims_user = _user_from_claims(token)
+        if claims_user is not None:
+            _user_cache[cache_key] = claims_user
+            return claims_user
+
         supabase = get_supabase_admin_client()
-        user_response = supabase.auth.get_user(token)
-        
-        if not user_response or not user_response.user:
-            return None
-        
-        user = user_response.user
-        profile_response = supabase.table("profiles").select("role").eq("id", user.id).single().execute()
-        
-        if not profile_response.data:
+        response = await run_in_threadpool(
+            supabase.rpc("get_user_with_profile", {"jwt": token}).execute
+        )
+
+        if not response.data:
             return None
-        
-        return AuthenticatedUser(
-            user_id=str(user.id),
-            email=user.email,
-            role=profile_response.data.get("role", "student")
+
+        data = response.data
+
+        authenticated_user = AuthenticatedUser(
+            user_id=str(data["id"]),
+            email=data["email"],
+            role=data.get("role", "student")
         )
+        _user_cache[cache_key] = authenticated_user
+        return authenticated_user
     except:
         return None
@@ -5,11 +5,40 @@ Uses service role key for admin operations.
 
 import os
 from functools import lru_cache
+
+import httpx
 from supabase import create_client, Client
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Shared pool limits for the Supabase HTTP sessions: enough keepalive
+# sockets for concurrent requests without exhausting ephemeral ports.
+_HTTP_LIMITS = httpx.Limits(max_connections=50, max_keepalive_connections=20)
+_HTTP_TIMEOUT = httpx.Timeout(15.0)
+
+
+def _tune_http_sessions(client: Client) -> Client:
+    """
+    Swap the default transports on the client's underlying httpx
+    sessions for pooled ones. Guarded with hasattr checks since the
+    session attributes are internal to postgrest/storage3.
+    """
+    sessions = []
+    postgrest = getattr(client, "postgrest", None)
+    if postgrest is not None and hasattr(postgrest, "session"):
+        sessions.append(postgrest.session)
+    storage = getattr(client, "storage", None)
+    if storage is not None and hasattr(storage, "session"):
+        sessions.append(storage.session)
+
+    for session in sessions:
+        if isinstance(session, httpx.Client):
+            session._transport = httpx.HTTPTransport(limits=_HTTP_LIMITS)
+            session.timeout = _HTTP_TIMEOUT
+
+    return client
+
 
 class Settings:
     """Application settings loaded from environment variables."""
@@ -17,17 +46,19 @@ class Settings:
     SUPABASE_URL: str = os.getenv("SUPABASE_URL", "")
     SUPABASE_ANON_KEY: str = os.getenv("SUPABASE_ANON_KEY", "")
     SUPABASE_SERVICE_ROLE_KEY: str = os.getenv("SUPABASE_SERVICE_ROLE_KEY", "")
+    SUPABASE_JWT_SECRET: str = os.getenv("SUPABASE_JWT_SECRET", "")
+    SUPABASE_DB_URL: str = os.getenv("SUPABASE_DB_URL", "")
     STORAGE_BUCKET: str = os.getenv("STORAGE_BUCKET", "course-materials")
     MAX_FILE_SIZE_MB: int = int(os.getenv("MAX_FILE_SIZE_MB", "50"))
     GEMINI_API_KEY: str = os.getenv("GEMINI_API_KEY", "")
     
-    # Allowed file extensions
-    ALLOWED_EXTENSIONS: set = {
+    # Allowed file extensions (immutable, shared across instances)
+    ALLOWED_EXTENSIONS: frozenset = frozenset({
         'pdf', 'pptx', 'ppt', 'docx', 'doc',  # Documents
         'py', 'js', 'ts', 'cpp', 'c', 'java', 'html', 'css',  # Code
         'md', 'txt', 'json', 'yaml', 'yml',  # Text
         'zip', 'tar', 'gz'  # Archives
-    }
+    })
 
 
 @lru_cache()
@@ -36,19 +67,26 @@ def get_settings() -> Settings:
     return Settings()
 
 
+@lru_cache(maxsize=1)
 def get_supabase_client() -> Client:
     """
-    Get Supabase client with anon key.
+    Get cached Supabase client with anon key.
     Used for user-authenticated operations.
     """
     settings = get_settings()
-    return create_client(settings.SUPABASE_URL, settings.SUPABASE_ANON_KEY)
+    return _tune_http_sessions(
+        create_client(settings.SUPABASE_URL, settings.SUPABASE_ANON_KEY)
+    )
 
 
+@lru_cache(maxsize=1)
 def get_supabase_admin_client() -> Client:
     """
-    Get Supabase client with service role key.
-    Used for admin operations that bypass RLS.
+    Get cached Supabase client with service role key.
+    Reused across requests so the underlying HTTP connection
+    pool stays warm. Used for admin operations that bypass RLS.
     """
     settings = get_settings()
-    return create_client(settings.SUPABASE_URL, settings.SUPABASE_SERVICE_ROLE_KEY)
+    return _tune_http_sessions(
+        create_client(settings.SUPABASE_URL, settings.SUPABASE_SERVICE_ROLE_KEY)
+    )
@@ -0,0 +1,72 @@
+"""
+Optional direct Postgres access for read-heavy queries.
+Maintains a pooled asyncpg connection to the Supavisor pooler
+(port 6543) so simple reads skip the REST layer entirely.
+Endpoints fall back to supabase-py when no pool is configured.
+"""
+
+from typing import Optional
+
+import asyncpg
+
+from config import get_settings
+
+_pool: Optional[asyncpg.Pool] = None
+
+
+async def _init_connection(conn: asyncpg.Connection):
+    """
+    Register text codecs for the pgvector types so callers can pass
+    embeddings as their '[v1,v2,...]' literals without the pgvector
+    client library. Best-effort: types may not exist until the vector
+    migrations have run.
+    """
+    for type_name in ("vector", "halfvec"):
+        try:
+            await conn.set_type_codec(
+                type_name,
+                schema="public",
+                encoder=str,
+                decoder=str,
+                format="text"
+            )
+        except Exception:
+            pass
+
+
+async def init_pool() -> Optional[asyncpg.Pool]:
+    """
+    Create the shared pool if SUPABASE_DB_URL is configured.
+    Called from the FastAPI lifespan at startup.
+    """
+    global _pool
+    settings = get_settings()
+
+    if not settings.SUPABASE_DB_URL:
+        return None
+
+    if _pool is None:
+        # statement_cache_size=0 is required behind Supavisor
+        # transaction mode, which multiplexes server connections.
+        _pool = await asyncpg.create_pool(
+            settings.SUPABASE_DB_URL,
+            min_size=5,
+            max_size=20,
+            statement_cache_size=0,
+            init=_init_connection
+        )
+
+    return _pool
+
+
+async def close_pool():
+    """Close the shared pool at shutdown."""
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+def get_pool() -> Optional[asyncpg.Pool]:
+    """Get the shared pool, or None when direct access is not configured."""
+    return _pool
@@ -3,8 +3,12 @@ FastAPI Main Application
 AI-Powered Supplementary Learning Platform - Backend API
 """
 
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -12,6 +16,24 @@ load_dotenv()
 
 # Import routers
 from routers import materials_router, search_router, chat_router, generate_router
+from config import get_supabase_admin_client
+from db import init_pool, close_pool
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm the shared Supabase client at startup so the first request
+    # doesn't pay the client construction + TLS handshake cost.
+    get_supabase_admin_client()
+    # Optional pooled Postgres connection for direct reads
+    await init_pool()
+    # Batch flusher for material access logs
+    from routers.materials import flush_access_logs
+    log_flusher = asyncio.create_task(flush_access_logs())
+    yield
+    log_flusher.cancel()
+    await close_pool()
+
 
 # Initialize the FastAPI application
 app = FastAPI(
@@ -19,7 +41,11 @@ app = FastAPI(
     description="Backend API for AI-Powered Supplementary Learning Platform",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    # orjson handles datetime/uuid natively, so the material and search
+    # list payloads need no custom encoders
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
 # Configure CORS for frontend
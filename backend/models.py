@@ -79,9 +79,12 @@ class MaterialResponse(BaseModel):
 class MaterialListResponse(BaseModel):
     """Response model for listing materials."""
     materials: List[MaterialResponse]
-    total: int
+    # Estimated on unfiltered pages; None on filtered pages, where
+    # clients should paginate with has_more instead
+    total: Optional[int] = None
     page: int = 1
     page_size: int = 20
+    has_more: bool = False
 
 
 class UploadResponse(BaseModel):
@@ -3,7 +3,12 @@ Chat router for conversational interface.
 Provides endpoints for managing conversations and chat messages.
 """
 
+import asyncio
+from functools import lru_cache
+
+import orjson
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from typing import List, Optional
 
 from auth import get_current_user, AuthenticatedUser
@@ -18,8 +23,13 @@ from models import (
 router = APIRouter(prefix="/api/chat", tags=["chat"])
 
 
+@lru_cache(maxsize=1)
 def get_chat_service() -> ChatService:
-    """Get ChatService instance."""
+    """
+    Get the shared ChatService instance.
+    Built once and reused so the GenAI and Supabase clients it wraps
+    are not reconstructed on every request.
+    """
     settings = get_settings()
     supabase = get_supabase_admin_client()
     rag_service = RAGService(supabase, settings.GEMINI_API_KEY)
@@ -82,31 +92,37 @@ async def get_conversation(
     chat_service: ChatService = Depends(get_chat_service)
 ):
     """Get a conversation with its messages."""
-    conversation = await chat_service.get_conversation(conversation_id)
-    
+    # The two queries are independent, so overlap them instead of
+    # paying two sequential round trips.
+    conversation, messages = await asyncio.gather(
+        chat_service.get_conversation(conversation_id),
+        chat_service.get_messages(conversation_id)
+    )
+
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
-    
+
     # Verify ownership
     if conversation["user_id"] != user.user_id:
         raise HTTPException(status_code=403, detail="Access denied")
-    
-    messages = await chat_service.get_messages(conversation_id)
-    
+
+    # Rows come straight from Supabase, which already enforces the
+    # schema, so model_construct skips redundant re-validation.
     message_responses = []
     for msg in messages:
         sources = []
         if msg.get("sources"):
             for src in msg["sources"]:
-                sources.append(SourceDocument(
+                sources.append(SourceDocument.model_construct(
                     file_name=src.get("file_name", ""),
                     page_number=src.get("page_number"),
                     excerpt=src.get("excerpt", ""),
                     similarity=src.get("similarity", 0),
-                    material_id=src.get("material_id", "")
+                    material_id=src.get("material_id", ""),
+                    file_url=src.get("file_url")
                 ))
-        
-        message_responses.append(ChatMessageResponse(
+
+        message_responses.append(ChatMessageResponse.model_construct(
             id=msg["id"],
             role=msg["role"],
             content=msg["content"],
@@ -211,3 +227,45 @@ async def send_message(
         sources=sources,
         intent=result.get("intent", "general")
     )
+
+
+@router.post("/message/stream")
+async def send_message_stream(
+    request: ChatRequest,
+    user: AuthenticatedUser = Depends(get_current_user),
+    chat_service: ChatService = Depends(get_chat_service)
+):
+    """
+    Streaming variant of /message using Server-Sent Events.
+    Emits `token` events as the LLM generates, then a final `done` event
+    with the persisted message, sources, and intent. Cuts perceived
+    latency from full-completion time to time-to-first-token.
+    """
+    conversation_id = request.conversation_id
+
+    # Create new conversation if needed
+    if not conversation_id:
+        conversation = await chat_service.create_conversation(
+            user_id=user.user_id,
+            title="New Chat"
+        )
+        if not conversation:
+            raise HTTPException(status_code=500, detail="Failed to create conversation")
+        conversation_id = conversation["id"]
+    else:
+        # Verify ownership
+        existing = await chat_service.get_conversation(conversation_id)
+        if not existing:
+            raise HTTPException(status_code=404, detail="Conversation not found")
+        if existing["user_id"] != user.user_id:
+            raise HTTPException(status_code=403, detail="Access denied")
+
+    async def event_stream():
+        async for event in chat_service.chat_stream(
+            conversation_id=conversation_id,
+            user_message=request.message,
+            user_id=user.user_id
+        ):
+            yield b"data: " + orjson.dumps(event) + b"\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
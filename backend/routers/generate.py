@@ -1,15 +1,48 @@
 from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
 from typing import Dict, Any, Optional
-import json
-import urllib.request
-import urllib.parse
+from functools import lru_cache
+import orjson
+import httpx
+from cachetools import TTLCache
 from config import get_supabase_admin_client, get_settings
-from services.rag_service import RAGService
-from langchain_google_genai import ChatGoogleGenerativeAI
 
 router = APIRouter(prefix="/api/generate", tags=["Generation"])
 
+
+@lru_cache(maxsize=1)
+def _get_rag_service():
+    """Shared RAGService so its SDK clients stay warm across requests."""
+    # Lazy import: langchain costs hundreds of ms, only pay on first use
+    from services.rag_service import RAGService
+    settings = get_settings()
+    return RAGService(get_supabase_admin_client(), settings.GEMINI_API_KEY)
+
+
+@lru_cache(maxsize=1)
+def _get_llm():
+    """Shared Gemini client; stateless aside from the API key."""
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    settings = get_settings()
+    return ChatGoogleGenerativeAI(
+        model="gemini-2.5-flash",
+        google_api_key=settings.GEMINI_API_KEY,
+        temperature=0.3,
+    )
+
+WIKI_API_URL = "https://en.wikipedia.org/w/api.php"
+
+# Shared client so Wikipedia calls reuse keepalive connections
+# instead of paying a TCP/TLS handshake per request.
+_wiki_client = httpx.AsyncClient(
+    timeout=5.0,
+    limits=httpx.Limits(max_keepalive_connections=20)
+)
+
+# The same topic tends to be requested repeatedly during a class
+# session, so cache extracts for 10 minutes.
+_wiki_cache: TTLCache = TTLCache(maxsize=256, ttl=600)
+
 class GenerateRequest(BaseModel):
     topic: str
     audience: str = "undergraduate"
@@ -21,12 +54,8 @@ class GenerateResponse(BaseModel):
 
 @router.post("", response_model=GenerateResponse)
 async def generate_content(request: GenerateRequest):
-    settings = get_settings()
-    supabase = get_supabase_admin_client()
-    
-    # Init RAG
-    rag_service = RAGService(supabase, settings.GEMINI_API_KEY)
-    
+    rag_service = _get_rag_service()
+
     # 1. RAG Search
     chunks = await rag_service.search(request.topic, limit=5, threshold=0.4)
     rag_context = "\n\n".join([c.chunk_text for c in chunks])
@@ -34,29 +63,37 @@ async def generate_content(request: GenerateRequest):
         rag_context = "No specific internal documents found."
 
     # 2. Wikipedia Search (Optional)
-    wiki_context = ""
-    try:
-        # Simple search
-        search_url = f"https://en.wikipedia.org/w/api.php?action=query&list=search&srsearch={urllib.parse.quote(request.topic)}&format=json"
-        with urllib.request.urlopen(search_url) as response:
-            data = json.loads(response.read().decode())
-            if data['query']['search']:
-                page_id = data['query']['search'][0]['pageid']
-                # Get content
-                content_url = f"https://en.wikipedia.org/w/api.php?action=query&prop=extracts&exintro&explaintext&pageids={page_id}&format=json"
-                with urllib.request.urlopen(content_url) as c_response:
-                    c_data = json.loads(c_response.read().decode())
-                    wiki_context = c_data['query']['pages'][str(page_id)]['extract']
-    except Exception:
-        wiki_context = "Wikipedia unavailable."
+    wiki_context = _wiki_cache.get(request.topic)
+    if wiki_context is None:
+        wiki_context = ""
+        try:
+            # generator=search pipes the top search hit straight into
+            # prop=extracts, so search + content is one round trip
+            response = await _wiki_client.get(WIKI_API_URL, params={
+                "action": "query",
+                "generator": "search",
+                "gsrsearch": request.topic,
+                "gsrlimit": 1,
+                "prop": "extracts",
+                "exintro": 1,
+                "explaintext": 1,
+                "format": "json"
+            })
+            data = orjson.loads(response.content)
+            pages = data.get('query', {}).get('pages', {})
+            if pages:
+                page = next(iter(pages.values()))
+                # Truncate immediately — extracts can be tens of KB and
+                # only the first 2000 chars ever reach the prompt
+                wiki_context = page.get('extract', '')[:2000]
+            # Only cache successful lookups
+            _wiki_cache[request.topic] = wiki_context
+        except Exception:
+            wiki_context = "Wikipedia unavailable."
 
     # 3. LLM Call
-    llm = ChatGoogleGenerativeAI(
-        model="gemini-2.5-flash",
-        google_api_key=settings.GEMINI_API_KEY,
-        temperature=0.3,
-    )
-    
+    llm = _get_llm()
+
     prompt = """You are an academic content generation engine.
 
 TASK:
@@ -92,27 +129,21 @@ REQUIRED JSON SCHEMA:
         topic=request.topic,
         audience=request.audience,
         rag_context=rag_context,
-        wiki_context=wiki_context[:2000] 
+        wiki_context=wiki_context
     )
     
     try:
-        response = llm.invoke(formatted_prompt)
+        # Gemini calls take seconds; await the async client so the
+        # event loop keeps serving other requests meanwhile.
+        response = await llm.ainvoke(formatted_prompt)
         content = response.content
         
-        # Clean up code blocks
-        if content.startswith("```json"):
-            content = content[7:]
-        elif content.startswith("```"):
-            content = content[3:]
-            
-        if content.endswith("```"):
-            content = content[:-3]
-            
-        content = content.strip()
-        
-        data = json.loads(content)
+        # Clean up code fences around the JSON payload
+        content = content.removeprefix("```json").removeprefix("```").removesuffix("```").strip()
+
+        data = orjson.loads(content)
         return data
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         raise HTTPException(status_code=500, detail="LLM failed to generate valid JSON")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -3,10 +3,19 @@ Materials API router for course content management.
 Handles file uploads, CRUD operations, and filtering.
 """
 
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query
-from typing import Optional, List
-import uuid
+import asyncio
+import hashlib
+import logging
+
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request, Response, UploadFile, File, Form, Query
+from fastapi.concurrency import run_in_threadpool
+from typing import Optional, List, Dict, Tuple
+from cachetools import TTLCache
+import os
+import secrets
 import re
+import tempfile
+import time
 
 from config import get_supabase_admin_client, get_settings
 from auth import AuthenticatedUser, get_current_user, require_admin
@@ -16,17 +25,166 @@ from models import (
     CategoryEnum, ContentTypeEnum
 )
 
+logger = logging.getLogger(__name__)
+
+# Fire-and-forget storage cleanup tasks: the event loop only keeps weak
+# references, so hold each task here until it finishes or it can be
+# garbage-collected mid-flight
+_cleanup_tasks: set = set()
+
+
+def _log_cleanup_error(task: asyncio.Task):
+    """Surface failures from background storage cleanup tasks."""
+    _cleanup_tasks.discard(task)
+    if not task.cancelled() and task.exception():
+        logger.error("Storage cleanup failed: %s", task.exception())
+
+
 router = APIRouter(prefix="/api/materials", tags=["Materials"])
 settings = get_settings()
 
+# Compiled once; replaces spaces and special chars with underscores
+_SANITIZE_RE = re.compile(r'[^\w\-.]')
+
+# Signed URLs are valid for an hour; cache them slightly shorter so a
+# cached URL always has at least 5 minutes of life left. Saves one
+# storage API round trip per material per page load.
+_signed_url_cache: TTLCache = TTLCache(maxsize=2048, ttl=3300)
+
+
+# Declarative filter spec for list_materials: query param name mapped
+# to (PostgREST operator, value transform). Walked once per request
+# instead of re-deriving the same branch chain; tags and search need
+# bespoke handling and stay separate.
+_LIST_FILTERS = (
+    ("category", "eq", lambda v: v.value),
+    ("week_number", "eq", None),
+    ("topic", "ilike", lambda v: f"%{v}%"),
+    ("content_type", "eq", lambda v: v.value),
+)
+
+
+# Access-log events buffer here and flush in batches from a background
+# task, so material views never pay the insert round trip inline.
+_access_log_queue: asyncio.Queue = asyncio.Queue()
+_ACCESS_LOG_BATCH = 100
+_ACCESS_LOG_INTERVAL = 2.0
+
+
+async def flush_access_logs():
+    """
+    Background loop: drain queued access-log events and bulk-insert
+    them. Started from the app lifespan; logging is best-effort, so
+    failed batches are dropped rather than retried.
+    """
+    supabase = get_supabase_admin_client()
+    while True:
+        batch = [await _access_log_queue.get()]
+        while len(batch) < _ACCESS_LOG_BATCH and not _access_log_queue.empty():
+            batch.append(_access_log_queue.get_nowait())
+        try:
+            await run_in_threadpool(
+                supabase.table("material_access_logs").insert(batch).execute
+            )
+        except Exception:
+            pass  # Non-critical, don't crash the flusher
+        await asyncio.sleep(_ACCESS_LOG_INTERVAL)
+
+
+def _get_signed_url_entry(supabase, file_path: str) -> Optional[Tuple[str, int]]:
+    """
+    Get a (presigned URL, minted-at epoch) pair, served from cache when
+    warm. The epoch feeds the response ETags: a URL rotation must change
+    the ETag, or revalidating clients would 304 onto an expired URL.
+    """
+    entry = _signed_url_cache.get(file_path)
+    if entry is not None:
+        return entry
+    try:
+        url_response = supabase.storage.from_(settings.STORAGE_BUCKET).create_signed_url(
+            file_path,
+            expires_in=3600  # 1 hour
+        )
+        url = url_response.get("signedURL")
+        if url:
+            entry = (url, int(time.time()))
+            _signed_url_cache[file_path] = entry
+        return entry
+    except:
+        return None
+
+
+def get_signed_url(supabase, file_path: str) -> Optional[str]:
+    """Get a presigned download URL, served from cache when warm."""
+    entry = _get_signed_url_entry(supabase, file_path)
+    return entry[0] if entry else None
+
+
+def _get_signed_url_entries(supabase, file_paths: List[str]) -> Dict[str, Tuple[str, int]]:
+    """
+    Get (presigned URL, minted-at epoch) pairs for many paths at once.
+    Cache hits are served locally; the remaining paths go to storage in
+    a single bulk create_signed_urls call instead of one call per row.
+    """
+    entries: Dict[str, Tuple[str, int]] = {}
+    missing = []
+    for path in file_paths:
+        cached = _signed_url_cache.get(path)
+        if cached is not None:
+            entries[path] = cached
+        else:
+            missing.append(path)
+
+    if missing:
+        try:
+            responses = supabase.storage.from_(settings.STORAGE_BUCKET).create_signed_urls(
+                missing,
+                expires_in=3600
+            )
+            minted_at = int(time.time())
+            for item in responses:
+                url = item.get("signedURL")
+                path = item.get("path")
+                if path and url:
+                    entries[path] = (url, minted_at)
+                    _signed_url_cache[path] = entries[path]
+        except:
+            pass
+
+    return entries
+
 
 def sanitize_filename(filename: str) -> str:
     """Sanitize filename to be safe for storage."""
-    # Remove any path components
-    filename = filename.split("/")[-1].split("\\")[-1]
-    # Replace spaces and special chars with underscores
-    filename = re.sub(r'[^\w\-.]', '_', filename)
-    return filename
+    # Strip any path components, then neutralize unsafe characters
+    filename = filename.rsplit("/", 1)[-1].rsplit("\\", 1)[-1]
+    return _SANITIZE_RE.sub('_', filename)
+
+
+def _row_to_response(item: dict, file_url: Optional[str] = None) -> MaterialResponse:
+    """
+    Map a course_materials row to the API response model.
+    Rows come from our own database with types already enforced, so
+    model_construct skips redundant field validation.
+    """
+    return MaterialResponse.model_construct(
+        id=item["id"],
+        title=item["title"],
+        description=item.get("description"),
+        file_path=item["file_path"],
+        file_name=item["file_name"],
+        file_type=item["file_type"],
+        file_size_bytes=item.get("file_size_bytes"),
+        category=item["category"],
+        topic=item.get("topic"),
+        week_number=item.get("week_number"),
+        tags=item.get("tags", []),
+        content_type=item.get("content_type"),
+        file_url=file_url,
+        uploaded_by=item.get("uploaded_by"),
+        created_at=item["created_at"],
+        updated_at=item["updated_at"]
+    )
 
 
 def get_file_extension(filename: str) -> str:
@@ -38,7 +196,7 @@ def get_file_extension(filename: str) -> str:
 
 def generate_storage_path(category: str, week_number: Optional[int], filename: str) -> str:
     """Generate a unique storage path for the file."""
-    unique_id = str(uuid.uuid4())[:8]
+    unique_id = secrets.token_hex(4)
     safe_filename = sanitize_filename(filename)
     
     if week_number:
@@ -51,8 +209,50 @@ def generate_storage_path(category: str, week_number: Optional[int], filename: s
 # Upload Endpoint
 # ============================================
 
+async def _index_in_background(
+    tmp_path: str,
+    material_id: str,
+    file_name: str,
+    file_type: str,
+    title: str,
+    description: Optional[str],
+    category: str,
+    topic: Optional[str],
+    week_number: Optional[int],
+    tags: List[str]
+):
+    """
+    Run RAG indexing after the upload response has been sent.
+    Owns the temp file and removes it when done.
+    """
+    try:
+        from services.rag_service import RAGService
+        supabase = get_supabase_admin_client()
+        rag_service = RAGService(supabase, settings.GEMINI_API_KEY)
+        with open(tmp_path, "rb") as f:
+            file_content = f.read()
+        await rag_service.index_material(
+            material_id=material_id,
+            file_content=file_content,
+            file_name=file_name,
+            file_type=file_type,
+            title=title,
+            description=description,
+            category=category,
+            topic=topic,
+            week_number=week_number,
+            tags=tags
+        )
+    except Exception:
+        logger.exception("Background indexing failed for %s", material_id)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
 @router.post("/upload", response_model=UploadResponse)
 async def upload_material(
+    background: BackgroundTasks,
     file: UploadFile = File(...),
     title: str = Form(...),
     description: Optional[str] = Form(None),
@@ -67,40 +267,57 @@ async def upload_material(
     Upload a new course material.
     Admin only.
     """
+    # Compute the derived names once; both are reused below
+    raw_name = file.filename or "unnamed"
+    safe_name = sanitize_filename(raw_name)
+    file_ext = get_file_extension(raw_name)  # already lowercase
+
     # Validate file extension
-    file_ext = get_file_extension(file.filename or "unknown")
     if file_ext not in settings.ALLOWED_EXTENSIONS:
         raise HTTPException(
             status_code=400,
             detail=f"File type '{file_ext}' not allowed. Allowed: {settings.ALLOWED_EXTENSIONS}"
         )
     
-    # Read file content
-    file_content = await file.read()
-    file_size = len(file_content)
-    
-    # Check file size
+    # Stream the upload to a temp file in 1MB pieces so a large file
+    # never sits fully in memory, and reject oversized uploads as soon
+    # as the limit is crossed instead of after reading everything.
     max_size = settings.MAX_FILE_SIZE_MB * 1024 * 1024
-    if file_size > max_size:
-        raise HTTPException(
-            status_code=400,
-            detail=f"File too large. Maximum size is {settings.MAX_FILE_SIZE_MB}MB"
-        )
-    
+    file_size = 0
+    tmp = tempfile.NamedTemporaryFile(delete=False)
+    tmp_path = tmp.name
+    try:
+        while chunk := await file.read(1024 * 1024):
+            file_size += len(chunk)
+            if file_size > max_size:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"File too large. Maximum size is {settings.MAX_FILE_SIZE_MB}MB"
+                )
+            tmp.write(chunk)
+        tmp.close()
+    except BaseException:
+        # Aborted uploads are routine (client disconnects mid-read) and
+        # disk errors happen — never leave the partial temp file behind
+        tmp.close()
+        os.remove(tmp_path)
+        raise
+
     # Generate storage path
     storage_path = generate_storage_path(
         category.value,
         week_number,
-        file.filename or "unnamed"
+        safe_name
     )
     
     supabase = get_supabase_admin_client()
-    
+    indexing_deferred = False
+
     try:
-        # Upload to Supabase Storage
+        # Upload to Supabase Storage (streamed from the temp file path)
         storage_response = supabase.storage.from_(settings.STORAGE_BUCKET).upload(
             path=storage_path,
-            file=file_content,
+            file=tmp_path,
             file_options={"content-type": file.content_type or "application/octet-stream"}
         )
         
@@ -114,7 +331,7 @@ async def upload_material(
             "title": title,
             "description": description,
             "file_path": storage_path,
-            "file_name": sanitize_filename(file.filename or "unnamed"),
+            "file_name": safe_name,
             "file_type": file_ext,
             "file_size_bytes": file_size,
             "category": category.value,
@@ -133,42 +350,48 @@ async def upload_material(
             raise HTTPException(status_code=500, detail="Failed to save material metadata")
         
         material_id = db_response.data[0]["id"]
-        
-        # Auto-index supported files for RAG search
+
+        # Auto-index supported files for RAG search. Indexing parses and
+        # embeds the whole document (5-30s), so defer it to a background
+        # task and return as soon as the storage + DB writes commit. The
+        # task takes ownership of the temp file. Progress is visible via
+        # /index-status (is_indexed flips once the task finishes).
         index_message = ""
         try:
             from services.rag_service import RAGService
-            if settings.GEMINI_API_KEY and file_ext.lower() in RAGService.SUPPORTED_TYPES:
-                rag_service = RAGService(supabase, settings.GEMINI_API_KEY)
-                result = await rag_service.index_material(
-                    material_id=material_id,
-                    file_content=file_content,
-                    file_name=sanitize_filename(file.filename or "unnamed"),
-                    file_type=file_ext,
-                    title=title,
-                    description=description,
-                    category=category.value,
-                    topic=topic,
-                    week_number=week_number,
-                    tags=tag_list
+            if settings.GEMINI_API_KEY and file_ext in RAGService.SUPPORTED_TYPES:
+                background.add_task(
+                    _index_in_background,
+                    tmp_path,
+                    material_id,
+                    safe_name,
+                    file_ext,
+                    title,
+                    description,
+                    category.value,
+                    topic,
+                    week_number,
+                    tag_list
                 )
-                if result["success"]:
-                    index_message = f" Indexed {result['chunks_created']} chunks for AI search."
-                else:
-                    index_message = f" Indexing failed: {result.get('error', 'Unknown error')}"
+                indexing_deferred = True
+                index_message = " Indexing for AI search started in the background."
         except Exception as e:
             index_message = f" Auto-indexing skipped: {str(e)}"
-        
+
         return UploadResponse(
             id=material_id,
             file_path=storage_path,
             message=f"Material uploaded successfully.{index_message}"
         )
-        
+
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
+    finally:
+        # The background indexing task deletes the temp file itself
+        if not indexing_deferred and os.path.exists(tmp_path):
+            os.remove(tmp_path)
 
 
 # ============================================
@@ -177,6 +400,8 @@ async def upload_material(
 
 @router.get("", response_model=MaterialListResponse)
 async def list_materials(
+    request: Request = None,
+    response: Response = None,
     category: Optional[CategoryEnum] = Query(None),
     week_number: Optional[int] = Query(None, ge=1, le=52),
     topic: Optional[str] = Query(None),
@@ -192,77 +417,90 @@ async def list_materials(
     Available to all authenticated users.
     """
     supabase = get_supabase_admin_client()
-    
-    # Build query
-    query = supabase.table("course_materials").select("*", count="exact")
-    
-    # Apply filters
-    if category:
-        query = query.eq("category", category.value)
-    
-    if week_number:
-        query = query.eq("week_number", week_number)
-    
-    if topic:
-        query = query.ilike("topic", f"%{topic}%")
-    
-    if content_type:
-        query = query.eq("content_type", content_type.value)
-    
+
+    # An exact count scans the whole filtered set just to report a
+    # total. Use the planner's estimate on the unfiltered path and, when
+    # filters apply, skip counting and probe one extra row for has_more.
+    has_filters = any(v is not None for v in (category, week_number, topic, content_type, tags, search))
+
+    if has_filters:
+        query = supabase.table("course_materials").select("*")
+    else:
+        query = supabase.table("course_materials").select("*", count="estimated")
+
+    # Apply filters from the declarative spec
+    filter_values = {
+        "category": category,
+        "week_number": week_number,
+        "topic": topic,
+        "content_type": content_type,
+    }
+    for name, op, transform in _LIST_FILTERS:
+        value = filter_values[name]
+        if value is not None:
+            query = query.filter(name, op, transform(value) if transform else value)
+
     if tags:
         tag_list = [t.strip() for t in tags.split(",") if t.strip()]
-        for tag in tag_list:
-            query = query.contains("tags", [tag])
+        if tag_list:
+            # One tags @> ARRAY[...] containment clause for all tags
+            # (GIN-indexed, 12_tags_gin_index.sql) instead of chaining
+            # a separate filter per tag
+            query = query.contains("tags", tag_list)
     
     if search:
-        query = query.or_(f"title.ilike.%{search}%,description.ilike.%{search}%")
+        # Indexed full-text search over title + description
+        # (search_tsv generated column, 10_materials_fts.sql)
+        query = query.text_search("search_tsv", search, options={"config": "english", "type": "plain"})
     
-    # Order and paginate
+    # Order and paginate (one extra row on filtered pages for has_more)
     offset = (page - 1) * page_size
-    query = query.order("created_at", desc=True).range(offset, offset + page_size - 1)
-    
+    fetch_size = page_size + 1 if has_filters else page_size
+    query = query.order("created_at", desc=True).range(offset, offset + fetch_size - 1)
+
     try:
-        response = query.execute()
-        
-        # Generate presigned URLs for downloads
-        materials = []
-        for item in response.data:
-            file_url = None
-            try:
-                url_response = supabase.storage.from_(settings.STORAGE_BUCKET).create_signed_url(
-                    item["file_path"], 
-                    expires_in=3600  # 1 hour
-                )
-                file_url = url_response.get("signedURL")
-            except:
-                pass
-            
-            materials.append(MaterialResponse(
-                id=item["id"],
-                title=item["title"],
-                description=item.get("description"),
-                file_path=item["file_path"],
-                file_name=item["file_name"],
-                file_type=item["file_type"],
-                file_size_bytes=item.get("file_size_bytes"),
-                category=item["category"],
-                topic=item.get("topic"),
-                week_number=item.get("week_number"),
-                tags=item.get("tags", []),
-                content_type=item.get("content_type"),
-                file_url=file_url,
-                uploaded_by=item.get("uploaded_by"),
-                created_at=item["created_at"],
-                updated_at=item["updated_at"]
-            ))
-        
+        db_response = query.execute()
+
+        rows = db_response.data
+        if has_filters:
+            total = None
+            has_more = len(rows) > page_size
+            rows = rows[:page_size]
+        else:
+            total = db_response.count if db_response.count is not None else len(rows)
+            has_more = offset + page_size < total
+
+        # Generate presigned URLs for the whole page in one storage call
+        # (before the ETag: the URL epochs are part of it, so a rotated
+        # URL invalidates clients holding the expired one; on the 304
+        # path the entries are warm and this is all cache hits)
+        entry_map = _get_signed_url_entries(supabase, [item["file_path"] for item in rows])
+
+        # ETag over the page contents + URL epochs: on If-None-Match
+        # hit, skip serialization entirely
+        etag_basis = "|".join(
+            f"{item['id']}:{item['updated_at']}:{entry_map.get(item['file_path'], ('', 0))[1]}"
+            for item in rows
+        )
+        etag = f'W/"{hashlib.md5(etag_basis.encode()).hexdigest()}"'
+        if request is not None and request.headers.get("if-none-match") == etag:
+            return Response(status_code=304)
+        if response is not None:
+            response.headers["ETag"] = etag
+
+        materials = [
+            _row_to_response(item, (entry_map.get(item["file_path"]) or (None,))[0])
+            for item in rows
+        ]
+
         return MaterialListResponse(
             materials=materials,
-            total=response.count or len(materials),
+            total=total,
             page=page,
-            page_size=page_size
+            page_size=page_size,
+            has_more=has_more
         )
-        
+
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Query failed: {str(e)}")
 
@@ -274,6 +512,8 @@ async def list_materials(
 @router.get("/{material_id}", response_model=MaterialResponse)
 async def get_material(
     material_id: str,
+    request: Request = None,
+    response: Response = None,
     user: AuthenticatedUser = Depends(get_current_user)
 ):
     """
@@ -283,53 +523,36 @@ async def get_material(
     supabase = get_supabase_admin_client()
     
     try:
-        response = supabase.table("course_materials").select("*").eq("id", material_id).single().execute()
-        
-        if not response.data:
+        db_response = supabase.table("course_materials").select("*").eq("id", material_id).single().execute()
+
+        if not db_response.data:
             raise HTTPException(status_code=404, detail="Material not found")
+
+        item = db_response.data
+
+        # Presigned URL first (cached): its minted-at epoch goes into
+        # the ETag, since the body embeds the URL — a 304 is only valid
+        # while the client's copy of the URL is the current one
+        entry = _get_signed_url_entry(supabase, item["file_path"])
+        file_url, url_epoch = entry if entry else (None, 0)
+
+        # Weak ETag from updated_at + URL epoch: unchanged rows with a
+        # still-fresh URL short-circuit to 304
+        etag = f'W/"{item["updated_at"]}:{url_epoch}"'
+        if request is not None and request.headers.get("if-none-match") == etag:
+            return Response(status_code=304)
+        if response is not None:
+            response.headers["ETag"] = etag
+
+        # Log access (optional) — queued for the batch flusher
+        _access_log_queue.put_nowait({
+            "material_id": material_id,
+            "user_id": user.user_id,
+            "access_type": "view"
+        })
         
-        item = response.data
-        
-        # Generate presigned URL
-        file_url = None
-        try:
-            url_response = supabase.storage.from_(settings.STORAGE_BUCKET).create_signed_url(
-                item["file_path"],
-                expires_in=3600
-            )
-            file_url = url_response.get("signedURL")
-        except:
-            pass
-        
-        # Log access (optional)
-        try:
-            supabase.table("material_access_logs").insert({
-                "material_id": material_id,
-                "user_id": user.user_id,
-                "access_type": "view"
-            }).execute()
-        except:
-            pass  # Non-critical, don't fail the request
-        
-        return MaterialResponse(
-            id=item["id"],
-            title=item["title"],
-            description=item.get("description"),
-            file_path=item["file_path"],
-            file_name=item["file_name"],
-            file_type=item["file_type"],
-            file_size_bytes=item.get("file_size_bytes"),
-            category=item["category"],
-            topic=item.get("topic"),
-            week_number=item.get("week_number"),
-            tags=item.get("tags", []),
-            content_type=item.get("content_type"),
-            file_url=file_url,
-            uploaded_by=item.get("uploaded_by"),
-            created_at=item["created_at"],
-            updated_at=item["updated_at"]
-        )
-        
+        return _row_to_response(item, file_url)
+
     except HTTPException:
         raise
     except Exception as e:
@@ -372,13 +595,15 @@ async def update_material(
     
     try:
         response = supabase.table("course_materials").update(update_dict).eq("id", material_id).execute()
-        
+
         if not response.data:
             raise HTTPException(status_code=404, detail="Material not found")
-        
-        # Return updated material
-        return await get_material(material_id, admin)
-        
+
+        # PostgREST returns the updated row, so build the response from
+        # it directly instead of re-selecting via get_material
+        item = response.data[0]
+        return _row_to_response(item, get_signed_url(supabase, item["file_path"]))
+
     except HTTPException:
         raise
     except Exception as e:
@@ -401,24 +626,24 @@ async def delete_material(
     supabase = get_supabase_admin_client()
     
     try:
-        # Get material first to find file path
-        material = supabase.table("course_materials").select("file_path").eq("id", material_id).single().execute()
-        
-        if not material.data:
+        # Single round trip: DELETE returns the deleted row, which also
+        # closes the select-then-delete race window
+        response = supabase.table("course_materials").delete().eq("id", material_id).execute()
+
+        if not response.data:
             raise HTTPException(status_code=404, detail="Material not found")
-        
-        file_path = material.data["file_path"]
-        
-        # Delete from storage
-        try:
-            supabase.storage.from_(settings.STORAGE_BUCKET).remove([file_path])
-        except Exception as e:
-            print(f"Warning: Failed to delete file from storage: {e}")
-            # Continue anyway - file might already be gone
-        
-        # Delete from database
-        supabase.table("course_materials").delete().eq("id", material_id).execute()
-        
+
+        file_path = response.data[0]["file_path"]
+
+        # Storage cleanup is best-effort (file might already be gone),
+        # so don't hold the response for it — but keep the task alive
+        # and log failures instead of dropping them
+        task = asyncio.create_task(run_in_threadpool(
+            supabase.storage.from_(settings.STORAGE_BUCKET).remove, [file_path]
+        ))
+        _cleanup_tasks.add(task)
+        task.add_done_callback(_log_cleanup_error)
+
         return MessageResponse(message="Material deleted successfully")
         
     except HTTPException:
@@ -2,10 +2,14 @@
 Search API router for RAG-based intelligent search.
 """
 
+import asyncio
+
 from fastapi import APIRouter, HTTPException, Depends
+from fastapi.concurrency import run_in_threadpool
 from typing import Optional
 
 from config import get_supabase_admin_client, get_settings
+from db import get_pool
 from auth import AuthenticatedUser, get_current_user, require_admin
 from models import (
     SearchRequest, SearchResponse, SearchResult,
@@ -71,9 +75,10 @@ async def ingest_material(
             category=material.get("category"),
             topic=material.get("topic"),
             week_number=material.get("week_number"),
-            tags=material.get("tags")
+            tags=material.get("tags"),
+            force=force
         )
-        
+
         if not result["success"]:
             raise HTTPException(status_code=500, detail=result.get("error"))
         
@@ -196,48 +201,81 @@ async def ingest_all(
         if not materials:
             return MessageResponse(message="No unindexed materials found with supported file types.")
         
-        success, errors = 0, 0
-        for m in materials:
-            try:
-                file_data = supabase.storage.from_(settings.STORAGE_BUCKET).download(m["file_path"])
-                result = await rag.index_material(
-                    material_id=m["id"],
-                    file_content=file_data,
-                    file_name=m.get("file_name", "unknown"),
-                    file_type=m.get("file_type", "txt"),
-                    title=m.get("title"),
-                    description=m.get("description"),
-                    category=m.get("category"),
-                    topic=m.get("topic"),
-                    week_number=m.get("week_number"),
-                    tags=m.get("tags")
-                )
-                if result["success"]:
-                    success += 1
-                else:
-                    errors += 1
-            except:
-                errors += 1
-        
+        # Each material is I/O-bound (storage download + embedding API),
+        # so index several in flight at once, bounded to avoid hammering
+        # the embedding provider's rate limits.
+        semaphore = asyncio.Semaphore(8)
+
+        async def index_one(m) -> bool:
+            async with semaphore:
+                try:
+                    file_data = await run_in_threadpool(
+                        supabase.storage.from_(settings.STORAGE_BUCKET).download,
+                        m["file_path"]
+                    )
+                    result = await rag.index_material(
+                        material_id=m["id"],
+                        file_content=file_data,
+                        file_name=m.get("file_name", "unknown"),
+                        file_type=m.get("file_type", "txt"),
+                        title=m.get("title"),
+                        description=m.get("description"),
+                        category=m.get("category"),
+                        topic=m.get("topic"),
+                        week_number=m.get("week_number"),
+                        tags=m.get("tags")
+                    )
+                    return result["success"]
+                except:
+                    return False
+
+        results = await asyncio.gather(*(index_one(m) for m in materials))
+        success = sum(1 for ok in results if ok)
+        errors = len(results) - success
+
         return MessageResponse(message=f"Indexed {success} materials. Errors: {errors}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# Same aggregate as the index_stats function (11_index_stats.sql):
+# all three counts in one statement with shared buffer reads
+_INDEX_STATS_SQL = """
+    SELECT
+      COUNT(*) AS total_materials,
+      COUNT(*) FILTER (WHERE is_indexed) AS indexed_materials,
+      (SELECT COUNT(*) FROM document_chunks) AS total_chunks
+    FROM course_materials
+"""
+
+
 @router.get("/index-status")
 async def index_status(user: AuthenticatedUser = Depends(get_current_user)):
     """Get indexing statistics."""
+    # Prefer the pooled direct connection when configured — one plain
+    # query, so skipping the REST layer saves most of the latency.
+    pool = get_pool()
+    if pool is not None:
+        try:
+            row = await pool.fetchrow(_INDEX_STATS_SQL)
+            return {
+                "total_materials": row["total_materials"] or 0,
+                "indexed_materials": row["indexed_materials"] or 0,
+                "total_chunks": row["total_chunks"] or 0
+            }
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
     supabase = get_supabase_admin_client()
-    
+
     try:
-        total = supabase.table("course_materials").select("id", count="exact").execute()
-        indexed = supabase.table("course_materials").select("id", count="exact").eq("is_indexed", True).execute()
-        chunks = supabase.table("document_chunks").select("id", count="exact").execute()
-        
+        response = supabase.rpc("index_stats").execute()
+        row = response.data[0] if isinstance(response.data, list) else response.data
+
         return {
-            "total_materials": total.count or 0,
-            "indexed_materials": indexed.count or 0,
-            "total_chunks": chunks.count or 0
+            "total_materials": row.get("total_materials") or 0,
+            "indexed_materials": row.get("indexed_materials") or 0,
+            "total_chunks": row.get("total_chunks") or 0
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
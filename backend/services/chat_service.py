@@ -3,12 +3,86 @@ Chat Service with Rolling Summary Memory.
 Implements intent detection, strict context management, and citation-based responses.
 """
 
+import asyncio
+import logging
+import re
 from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime
 from supabase import Client
-from langchain_google_genai import ChatGoogleGenerativeAI
 
-from services.rag_service import RAGService
+from services.rag_service import RAGService, get_chat_model
+
+logger = logging.getLogger(__name__)
+
+
+def _log_task_error(task: asyncio.Task):
+    """Surface failures from fire-and-forget maintenance tasks."""
+    if not task.cancelled() and task.exception():
+        logger.error("Background chat task failed: %s", task.exception())
+
+
+# Static grounding rules appended to every intent instruction. Module
+# level so the per-intent system prompts can be precomputed at class load.
+_SYSTEM_GUIDELINES = """=== AI TUTOR BEHAVIOR GUIDELINES ===
+
+You are an expert AI tutor helping students learn from their course materials. Your role is to be a knowledgeable teaching assistant who can explain, compare, analyze, and help students understand concepts.
+
+=== KNOWLEDGE SOURCES (in priority order) ===
+
+1. **PRIMARY: Course Materials** - The [Course Materials] section below contains excerpts from the student's actual course content. This is your PRIMARY source of truth.
+
+2. **SECONDARY: Your Teaching Expertise** - You may use your general knowledge to:
+   - EXPLAIN concepts in simpler terms
+   - COMPARE topics using the course material as foundation
+   - PROVIDE ANALOGIES to help understanding
+   - ANALYZE pros/cons when asked
+   - ANSWER "which is better" type questions with reasoned arguments
+
+=== GROUNDING RULES ===
+
+**FACTS must be grounded:**
+- When stating FACTS, DEFINITIONS, or SPECIFIC DETAILS → You MUST cite course materials
+- Format: (Source: [filename], Page [number])
+- Example: "Genetic algorithms use natural selection principles (Source: GA_Slides.pdf, Page 5)."
+
+**REASONING can be synthesized:**
+- When COMPARING, ANALYZING, or giving OPINIONS → You may synthesize based on the grounded facts
+- Clearly distinguish your reasoning: "Based on the course materials, I would say..." or "Comparing these concepts..."
+- Still reference which materials you're basing your analysis on
+
+**When information is MISSING:**
+- If the student asks about something NOT covered in course materials at all:
+  "The course materials don't cover [topic] directly. Based on my general knowledge, [brief answer]. Would you like me to search for related topics in your materials?"
+- NEVER fabricate specific course content or citations
+
+=== RESPONSE STYLE ===
+
+1. **Be a helpful tutor**, not just a search engine
+2. **Explain clearly** with examples when helpful
+3. **Compare concepts** when asked - this is valuable for learning
+4. **Cite sources** for factual claims from materials
+5. **Be honest** about what's in materials vs. your reasoning
+6. **End with engagement** - ask if they want more detail or have follow-up questions
+
+=== EXAMPLE RESPONSES ===
+
+**Good (comparison question):**
+"Based on your course materials, both Genetic Algorithms and Adversarial Search are optimization techniques, but they're suited for different problems:
+
+**Genetic Algorithms** (Source: GA_Slides.pdf, Page 3-5):
+- Best for: Large search spaces, optimization problems
+- Approach: Population-based, evolutionary
+
+**Adversarial Search** (Source: Adversarial_Search.pdf, Page 2):
+- Best for: Game-playing, competitive scenarios
+- Approach: Minimax, assumes rational opponent
+
+*My analysis:* If you're working on a game with an opponent, adversarial search is more appropriate. For optimization without an opponent (like scheduling), genetic algorithms would be better. Would you like me to go deeper on either one?"
+
+**Good (missing info):**
+"I don't see information about neural networks in your course materials. The uploaded content focuses on search algorithms and optimization. Would you like me to explain what I found about related topics like genetic algorithms instead?"
+
+=== END OF GUIDELINES ==="""
 
 
 class ChatIntent:
@@ -35,82 +109,76 @@ class ChatService:
     """
     
     CONTEXT_WINDOW = 5  # Last 5 messages only
-    
+    MESSAGE_CHAR_BUDGET = 500  # Per-message cap inside the context window
+
+    # Intent keywords compiled once into alternation patterns so each
+    # message is scanned in a single C-level pass per intent instead of
+    # one Python-level substring probe per keyword. Order matters: first
+    # match wins, mirroring the original keyword-check order. A single
+    # combined automaton over all keywords (Aho-Corasick style) would be
+    # one pass total but ranks matches by position in the message rather
+    # than by intent priority, so "find me a summary" would flip from
+    # SUMMARIZE to SEARCH — hence one pattern per intent, checked in
+    # priority order.
+    _INTENT_PATTERNS = [
+        (ChatIntent.SUMMARIZE, re.compile(
+            r'summarize|summary|overview|brief|key points|main ideas|tldr', re.IGNORECASE)),
+        (ChatIntent.EXPLAIN, re.compile(
+            r'explain|clarify|what does|what is|how does|why|elaborate|different way|simpler|more detail', re.IGNORECASE)),
+        (ChatIntent.SEARCH, re.compile(
+            r'find|search|look for|where is|show me|list|what are', re.IGNORECASE)),
+        (ChatIntent.GENERATE_NOTES, re.compile(
+            r'generate notes|create notes|study notes|learning notes|make notes|write notes|reading notes', re.IGNORECASE)),
+        (ChatIntent.GENERATE_CODE, re.compile(
+            r'generate code|create code|write code|code example|show code|implement|programming example', re.IGNORECASE)),
+    ]
+
+    _FOLLOWUP_PATTERN = re.compile(
+        r'this|that|it|those|these|above|previous|same|more about', re.IGNORECASE)
+
     def __init__(self, supabase_client: Client, gemini_api_key: str, rag_service: RAGService):
         self.supabase = supabase_client
         self.rag_service = rag_service
         
-        self.llm = ChatGoogleGenerativeAI(
-            model="gemini-2.0-flash",
-            google_api_key=gemini_api_key,
-            temperature=0.2,  # Lower for more factual responses
-        )
-        
-        self.summarizer = ChatGoogleGenerativeAI(
-            model="gemini-2.0-flash",
-            google_api_key=gemini_api_key,
-            temperature=0.1,
-        )
+        # Pooled clients — shared across service instances per (model, temp)
+        self.llm = get_chat_model("gemini-2.0-flash", 0.2, gemini_api_key)  # Lower temp for more factual responses
+        self.summarizer = get_chat_model("gemini-2.0-flash", 0.1, gemini_api_key)
     
     def _detect_intent(self, message: str, has_history: bool) -> str:
         """
         Detect user intent from message.
         Returns: search, summarize, explain, followup, or general
         """
-        message_lower = message.lower()
-        
-        # Check for summarize intent
-        summarize_keywords = ['summarize', 'summary', 'overview', 'brief', 'key points', 'main ideas', 'tldr']
-        if any(kw in message_lower for kw in summarize_keywords):
-            return ChatIntent.SUMMARIZE
-        
-        # Check for explain/clarify intent
-        explain_keywords = ['explain', 'clarify', 'what does', 'what is', 'how does', 'why', 'elaborate', 'different way', 'simpler', 'more detail']
-        if any(kw in message_lower for kw in explain_keywords):
-            return ChatIntent.EXPLAIN
-        
-        # Check for search intent
-        search_keywords = ['find', 'search', 'look for', 'where is', 'show me', 'list', 'what are']
-        if any(kw in message_lower for kw in search_keywords):
-            return ChatIntent.SEARCH
-        
-        # Check for generate notes intent
-        generate_notes_keywords = ['generate notes', 'create notes', 'study notes', 'learning notes', 'make notes', 'write notes', 'reading notes']
-        if any(kw in message_lower for kw in generate_notes_keywords):
-            return ChatIntent.GENERATE_NOTES
-        
-        # Check for generate code intent
-        generate_code_keywords = ['generate code', 'create code', 'write code', 'code example', 'show code', 'implement', 'programming example']
-        if any(kw in message_lower for kw in generate_code_keywords):
-            return ChatIntent.GENERATE_CODE
-        
+        for intent, pattern in self._INTENT_PATTERNS:
+            if pattern.search(message):
+                return intent
+
         # Check for follow-up (references previous context)
-        followup_keywords = ['this', 'that', 'it', 'those', 'these', 'above', 'previous', 'same', 'more about']
-        if has_history and any(kw in message_lower for kw in followup_keywords):
+        if has_history and self._FOLLOWUP_PATTERN.search(message):
             return ChatIntent.FOLLOWUP
-        
+
         return ChatIntent.GENERAL
     
-    def _get_intent_prompt(self, intent: str) -> str:
-        """Get specialized prompt instructions based on intent."""
-        prompts = {
-            ChatIntent.SEARCH: """You are helping the user FIND specific information in course materials.
+    # Specialized prompt instructions per intent — built once at class
+    # load instead of reallocating the dict on every message
+    _INTENT_PROMPTS = {
+        ChatIntent.SEARCH: """You are helping the user FIND specific information in course materials.
 List relevant topics, files, and page numbers where this information can be found.
 Be direct and organized with your search results.""",
             
-            ChatIntent.SUMMARIZE: """You are helping the user get a SUMMARY of course content.
+        ChatIntent.SUMMARIZE: """You are helping the user get a SUMMARY of course content.
 Provide a concise, well-structured summary with key points.
 Use bullet points for clarity. Always cite the source materials.""",
             
-            ChatIntent.EXPLAIN: """You are helping the user UNDERSTAND a concept better.
+        ChatIntent.EXPLAIN: """You are helping the user UNDERSTAND a concept better.
 Explain clearly using simple language and examples where helpful.
 If you're re-explaining something, try a different approach or analogy.""",
             
-            ChatIntent.FOLLOWUP: """The user is asking a FOLLOW-UP question about the previous topic.
+        ChatIntent.FOLLOWUP: """The user is asking a FOLLOW-UP question about the previous topic.
 Build on the conversation context to provide a relevant answer.
 Reference back to what was discussed before.""",
             
-            ChatIntent.GENERATE_NOTES: """You are GENERATING comprehensive study notes based on course materials.
+        ChatIntent.GENERATE_NOTES: """You are GENERATING comprehensive study notes based on course materials.
 
 OUTPUT FORMAT (use this exact Markdown structure):
 # Study Notes: [Topic Name]
@@ -141,7 +209,7 @@ List any formulas, theorems, or key definitions.
 
 IMPORTANT: Make the notes comprehensive, well-organized, and ready to study from.""",
             
-            ChatIntent.GENERATE_CODE: """You are GENERATING code examples based on course materials.
+        ChatIntent.GENERATE_CODE: """You are GENERATING code examples based on course materials.
 
 OUTPUT FORMAT (use this exact Markdown structure):
 # Code Example: [Topic Name]
@@ -181,10 +249,20 @@ Links to other topics this connects to.
 IMPORTANT: Code must be syntactically correct, well-commented, and educational.
 Supported languages: Python (default), JavaScript, Java, C++.""",
             
-            ChatIntent.GENERAL: """You are an AI tutor helping the user learn from course materials.
+        ChatIntent.GENERAL: """You are an AI tutor helping the user learn from course materials.
 Provide helpful, accurate responses based on the available content."""
-        }
-        return prompts.get(intent, prompts[ChatIntent.GENERAL])
+    }
+
+    # Full system prompts (intent instruction + grounding guidelines),
+    # precomputed so _build_system_prompt is a dict lookup
+    _SYSTEM_PROMPTS = {
+        intent: f"{instruction}\n{_SYSTEM_GUIDELINES}"
+        for intent, instruction in _INTENT_PROMPTS.items()
+    }
+
+    def _get_intent_prompt(self, intent: str) -> str:
+        """Get specialized prompt instructions based on intent."""
+        return self._INTENT_PROMPTS.get(intent, self._INTENT_PROMPTS[ChatIntent.GENERAL])
     
     async def create_conversation(self, user_id: str, title: str = "New Chat") -> Dict[str, Any]:
         """Create a new conversation for a user."""
@@ -199,10 +277,11 @@ Provide helpful, accurate responses based on the available content."""
     
     async def get_conversation(self, conversation_id: str) -> Optional[Dict[str, Any]]:
         """Get a conversation by ID."""
-        result = self.supabase.table("conversations").select("*").eq(
+        query = self.supabase.table("conversations").select("*").eq(
             "id", conversation_id
-        ).single().execute()
-        
+        ).single()
+        result = await asyncio.to_thread(query.execute)
+
         return result.data if result.data else None
     
     async def list_conversations(self, user_id: str, limit: int = 20) -> List[Dict[str, Any]]:
@@ -218,35 +297,47 @@ Provide helpful, accurate responses based on the available content."""
         conversation_id: str, 
         limit: Optional[int] = None
     ) -> List[Dict[str, Any]]:
-        """Get messages for a conversation."""
+        """
+        Get messages for a conversation.
+        Sources are stored as a JSONB column on chat_messages, so each
+        message arrives with its sources in this single query — there is
+        no separate sources table to batch-load.
+        """
+        # Both rows of a turn share created_at (bulk insert, one
+        # transaction timestamp), so role breaks the tie: descending
+        # puts 'user' before 'assistant' within a turn
         query = self.supabase.table("chat_messages").select("*").eq(
             "conversation_id", conversation_id
-        ).order("created_at", desc=False)
-        
+        ).order("created_at", desc=False).order("role", desc=True)
+
         if limit:
             query = query.limit(limit)
-        
-        result = query.execute()
+
+        result = await asyncio.to_thread(query.execute)
         return result.data or []
     
     async def get_recent_messages(self, conversation_id: str) -> List[Dict[str, Any]]:
         """Get the most recent messages (strict 5-message window)."""
-        result = self.supabase.table("chat_messages").select("*").eq(
+        # Timestamps tie within a turn (bulk insert), so role ascending
+        # here yields user-before-assistant once the list is reversed
+        query = self.supabase.table("chat_messages").select("*").eq(
             "conversation_id", conversation_id
-        ).order("created_at", desc=True).limit(self.CONTEXT_WINDOW).execute()
-        
+        ).order("created_at", desc=True).order(
+            "role", desc=False
+        ).limit(self.CONTEXT_WINDOW)
+        result = await asyncio.to_thread(query.execute)
+
         # Reverse to get chronological order
         messages = result.data or []
         messages.reverse()
         return messages
     
-    async def _generate_summary(self, conversation_id: str) -> str:
-        """Generate a rolling summary of the conversation."""
-        conversation = await self.get_conversation(conversation_id)
-        if not conversation:
-            return ""
-        
-        existing_summary = conversation.get("rolling_summary", "")
+    async def _generate_summary(self, conversation_id: str, existing_summary: str = "") -> str:
+        """
+        Generate a rolling summary of the conversation.
+        The caller passes the current summary from the conversation row it
+        already holds, so no refetch is needed here.
+        """
         recent_messages = await self.get_recent_messages(conversation_id)
         
         if not recent_messages:
@@ -271,157 +362,107 @@ Recent Messages:
 Concise Summary:"""
 
         try:
-            response = self.summarizer.invoke(prompt)
+            response = await self.summarizer.ainvoke(prompt)
             return response.content.strip()
-        except Exception as e:
-            print(f"Summary generation error: {e}")
+        except Exception:
+            logger.exception("Summary generation failed")
             return existing_summary
     
-    async def _update_rolling_summary(self, conversation_id: str):
+    async def _update_rolling_summary(self, conversation_id: str, existing_summary: str = ""):
         """Update the rolling summary in the database."""
-        summary = await self._generate_summary(conversation_id)
+        summary = await self._generate_summary(conversation_id, existing_summary)
         
         self.supabase.table("conversations").update({
             "rolling_summary": summary
         }).eq("id", conversation_id).execute()
     
-    async def _build_context(self, conversation_id: str) -> Tuple[str, bool]:
+    def _build_context(
+        self,
+        conversation: Optional[Dict[str, Any]],
+        recent_messages: List[Dict[str, Any]]
+    ) -> Tuple[str, bool]:
         """
-        Build context for the LLM using rolling summary + last 5 messages ONLY.
+        Build context for the LLM: the rolling summary once it covers
+        older history, otherwise the raw recent window — never both, since
+        the summary already restates the newest turns and pairing them
+        just duplicates prompt tokens.
+        Pure formatting — the conversation row and messages are fetched by
+        the caller so the reads can run concurrently with RAG retrieval.
         Returns: (context_string, has_history)
         """
-        conversation = await self.get_conversation(conversation_id)
         rolling_summary = conversation.get("rolling_summary", "") if conversation else ""
-        
-        recent_messages = await self.get_recent_messages(conversation_id)
+        message_count = conversation.get("message_count", 0) if conversation else 0
         has_history = len(recent_messages) > 0
-        
-        context_parts = []
-        
-        if rolling_summary:
-            context_parts.append(f"[Previous Conversation Summary]\n{rolling_summary}")
-        
+
+        if message_count > self.CONTEXT_WINDOW and rolling_summary:
+            return f"[Previous Conversation Summary]\n{rolling_summary}", has_history
+
         if recent_messages:
-            # Only last 5 messages
-            messages_text = "\n".join([
-                f"{msg['role'].upper()}: {msg['content']}"
-                for msg in recent_messages[-5:]
-            ])
-            context_parts.append(f"[Recent Conversation (Last 5 messages)]\n{messages_text}")
-        
-        return "\n\n".join(context_parts), has_history
+            # Only last 5 messages, each capped so one long answer can't
+            # blow up the prompt
+            messages_text = "\n".join(
+                f"{msg['role'].upper()}: {msg['content'][:self.MESSAGE_CHAR_BUDGET]}"
+                for msg in recent_messages[-self.CONTEXT_WINDOW:]
+            )
+            return f"[Recent Conversation (Last 5 messages)]\n{messages_text}", has_history
+
+        return "", has_history
     
     def _build_system_prompt(self, intent: str) -> str:
-        """Build the system prompt with strict grounding rules."""
-        intent_instruction = self._get_intent_prompt(intent)
-        
-        return f"""{intent_instruction}
-=== AI TUTOR BEHAVIOR GUIDELINES ===
-
-You are an expert AI tutor helping students learn from their course materials. Your role is to be a knowledgeable teaching assistant who can explain, compare, analyze, and help students understand concepts.
-
-=== KNOWLEDGE SOURCES (in priority order) ===
-
-1. **PRIMARY: Course Materials** - The [Course Materials] section below contains excerpts from the student's actual course content. This is your PRIMARY source of truth.
-
-2. **SECONDARY: Your Teaching Expertise** - You may use your general knowledge to:
-   - EXPLAIN concepts in simpler terms
-   - COMPARE topics using the course material as foundation
-   - PROVIDE ANALOGIES to help understanding
-   - ANALYZE pros/cons when asked
-   - ANSWER "which is better" type questions with reasoned arguments
-
-=== GROUNDING RULES ===
-
-**FACTS must be grounded:**
-- When stating FACTS, DEFINITIONS, or SPECIFIC DETAILS → You MUST cite course materials
-- Format: (Source: [filename], Page [number])
-- Example: "Genetic algorithms use natural selection principles (Source: GA_Slides.pdf, Page 5)."
-
-**REASONING can be synthesized:**
-- When COMPARING, ANALYZING, or giving OPINIONS → You may synthesize based on the grounded facts
-- Clearly distinguish your reasoning: "Based on the course materials, I would say..." or "Comparing these concepts..."
-- Still reference which materials you're basing your analysis on
-
-**When information is MISSING:**
-- If the student asks about something NOT covered in course materials at all:
-  "The course materials don't cover [topic] directly. Based on my general knowledge, [brief answer]. Would you like me to search for related topics in your materials?"
-- NEVER fabricate specific course content or citations
-
-=== RESPONSE STYLE ===
-
-1. **Be a helpful tutor**, not just a search engine
-2. **Explain clearly** with examples when helpful
-3. **Compare concepts** when asked - this is valuable for learning
-4. **Cite sources** for factual claims from materials
-5. **Be honest** about what's in materials vs. your reasoning
-6. **End with engagement** - ask if they want more detail or have follow-up questions
-
-=== EXAMPLE RESPONSES ===
-
-**Good (comparison question):**
-"Based on your course materials, both Genetic Algorithms and Adversarial Search are optimization techniques, but they're suited for different problems:
-
-**Genetic Algorithms** (Source: GA_Slides.pdf, Page 3-5):
-- Best for: Large search spaces, optimization problems
-- Approach: Population-based, evolutionary
-
-**Adversarial Search** (Source: Adversarial_Search.pdf, Page 2):
-- Best for: Game-playing, competitive scenarios  
-- Approach: Minimax, assumes rational opponent
-
-*My analysis:* If you're working on a game with an opponent, adversarial search is more appropriate. For optimization without an opponent (like scheduling), genetic algorithms would be better. Would you like me to go deeper on either one?"
-
-**Good (missing info):**
-"I don't see information about neural networks in your course materials. The uploaded content focuses on search algorithms and optimization. Would you like me to explain what I found about related topics like genetic algorithms instead?"
-
-=== END OF GUIDELINES ==="""
+        """Return the precomputed system prompt for the intent."""
+        return self._SYSTEM_PROMPTS.get(intent, self._SYSTEM_PROMPTS[ChatIntent.GENERAL])
     
-    async def chat(
-        self, 
-        conversation_id: str, 
-        user_message: str,
-        user_id: str
-    ) -> Dict[str, Any]:
+    async def _prepare_turn(
+        self,
+        conversation_id: str,
+        user_message: str
+    ) -> Tuple[Dict[str, Any], str, Any, str, int, str]:
         """
-        Process a chat message and generate a grounded response.
-        Uses intent detection, RAG retrieval, and citation-based formatting.
+        Pre-LLM stage of a chat turn: fetch state, run retrieval, and
+        build the full prompt. Shared by chat() and chat_stream().
+        Returns: (user_row, full_prompt, rag_response, intent, new_count,
+        existing_summary) — the summary rides along so later stages never
+        refetch the conversation row.
         """
-        # Store user message
-        user_msg_result = self.supabase.table("chat_messages").insert({
+        # Buffer the user row; it is written together with the assistant
+        # reply in a single bulk insert after the LLM responds
+        user_row = {
             "conversation_id": conversation_id,
             "role": "user",
             "content": user_message,
             "sources": []
-        }).execute()
-        
-        # Update message count
-        conv_data = self.supabase.table("conversations").select("message_count").eq("id", conversation_id).single().execute()
-        current_count = conv_data.data.get("message_count", 0) if conv_data.data else 0
-        
-        self.supabase.table("conversations").update({
-            "message_count": current_count + 1
-        }).eq("id", conversation_id).execute()
-        
+        }
+        # Read conversation state and run RAG retrieval concurrently —
+        # independent round trips, so pre-LLM latency is the slowest of
+        # them, not the sum. The RPC atomically bumps message_count for
+        # this turn (user + assistant) and returns the updated count plus
+        # rolling summary, with no SELECT/UPDATE race under concurrent chats
+        conv_rpc = self.supabase.rpc(
+            "increment_and_fetch_conv", {"p_id": conversation_id, "p_delta": 2}
+        )
+
+        conv_data, recent_messages, rag_response = await asyncio.gather(
+            asyncio.to_thread(conv_rpc.execute),
+            self.get_recent_messages(conversation_id),
+            self.rag_service.ask(user_message, limit=5),
+        )
+        conv_row = conv_data.data[0] if conv_data.data else None
+        new_count = conv_row.get("message_count", 2) if conv_row else 2
+
         # Build conversation context (last 5 messages only)
-        conversation_context, has_history = await self._build_context(conversation_id)
-        
+        conversation_context, has_history = self._build_context(conv_row, recent_messages)
+
         # Detect user intent
         intent = self._detect_intent(user_message, has_history)
         
-        # Get RAG results for grounding
-        rag_response = await self.rag_service.ask(user_message, limit=5)
-        
         # Build course materials context with clear source attribution
-        course_materials = ""
         if rag_response.sources:
-            materials_parts = []
-            for i, src in enumerate(rag_response.sources):
-                page_info = f", Page {src.get('page_number')}" if src.get('page_number') else ""
-                materials_parts.append(
-                    f"--- Source {i+1}: {src['file_name']}{page_info} ---\n{src['excerpt']}"
-                )
-            course_materials = "\n\n".join(materials_parts)
+            course_materials = "\n\n".join(
+                f"--- Source {i+1}: {src['file_name']}"
+                + (f", Page {src.get('page_number')}" if src.get('page_number') else "")
+                + f" ---\n{src['excerpt']}"
+                for i, src in enumerate(rag_response.sources)
+            )
         else:
             course_materials = "No relevant course materials found for this query."
         
@@ -441,57 +482,143 @@ You are an expert AI tutor helping students learn from their course materials. Y
 
 [Your Response (remember to cite sources)]:"""
 
+        existing_summary = conv_row.get("rolling_summary", "") if conv_row else ""
+        return user_row, full_prompt, rag_response, intent, new_count, existing_summary
+
+    async def _finalize_turn(
+        self,
+        conversation_id: str,
+        user_message: str,
+        user_row: Dict[str, Any],
+        assistant_content: str,
+        sources_data: List[Dict[str, Any]],
+        new_count: int,
+        existing_summary: str = ""
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Post-LLM stage of a chat turn: persist both messages and run the
+        periodic summary/title maintenance. Returns the assistant row.
+        """
+        # Store both turn messages in one bulk insert (user row first so
+        # chronological order is preserved)
+        insert_result = self.supabase.table("chat_messages").insert([
+            user_row,
+            {
+                "conversation_id": conversation_id,
+                "role": "assistant",
+                "content": assistant_content,
+                "sources": sources_data
+            }
+        ]).execute()
+
+        assistant_msg = insert_result.data[1] if insert_result.data and len(insert_result.data) > 1 else None
+
+        # Update rolling summary periodically (every 4 messages) — the
+        # summary is only read by future turns, so run it in the
+        # background instead of adding an LLM round trip to this response
+        if new_count % 4 == 0:
+            task = asyncio.create_task(
+                self._update_rolling_summary(conversation_id, existing_summary)
+            )
+            task.add_done_callback(_log_task_error)
+
+        # Auto-generate title from first message
+        if new_count == 2:
+            await self._generate_title(conversation_id, user_message)
+
+        return assistant_msg
+
+    async def chat(
+        self,
+        conversation_id: str,
+        user_message: str,
+        user_id: str
+    ) -> Dict[str, Any]:
+        """
+        Process a chat message and generate a grounded response.
+        Uses intent detection, RAG retrieval, and citation-based formatting.
+        """
+        user_row, full_prompt, rag_response, intent, new_count, existing_summary = await self._prepare_turn(
+            conversation_id, user_message
+        )
+
         # Generate response
         try:
-            response = self.llm.invoke(full_prompt)
+            response = await self.llm.ainvoke(full_prompt)
             assistant_content = response.content
         except Exception as e:
             assistant_content = f"I apologize, but I encountered an error processing your request: {str(e)}"
-        
-        # Store assistant response with sources
+
         sources_data = rag_response.sources if rag_response.sources else []
-        
-        assistant_msg_result = self.supabase.table("chat_messages").insert({
-            "conversation_id": conversation_id,
-            "role": "assistant",
-            "content": assistant_content,
-            "sources": sources_data
-        }).execute()
-        
-        assistant_msg = assistant_msg_result.data[0] if assistant_msg_result.data else None
-        
-        # Update message count
-        self.supabase.table("conversations").update({
-            "message_count": current_count + 2
-        }).eq("id", conversation_id).execute()
-        
-        # Update rolling summary periodically (every 4 messages)
-        if (current_count + 2) % 4 == 0:
-            await self._update_rolling_summary(conversation_id)
-        
-        # Auto-generate title from first message
-        if current_count == 0:
-            await self._generate_title(conversation_id, user_message)
-        
+        assistant_msg = await self._finalize_turn(
+            conversation_id, user_message, user_row, assistant_content,
+            sources_data, new_count, existing_summary
+        )
+
         return {
             "conversation_id": conversation_id,
             "message": assistant_msg,
             "sources": sources_data,
             "intent": intent
         }
+
+    async def chat_stream(
+        self,
+        conversation_id: str,
+        user_message: str,
+        user_id: str
+    ):
+        """
+        Streaming variant of chat(): yields event dicts as the LLM
+        produces tokens, so the client sees the first token in ~hundreds
+        of milliseconds instead of waiting for the full completion.
+
+        Events: {"type": "token", "content": str} per chunk, then one
+        {"type": "done", ...} carrying the persisted message and sources.
+        """
+        user_row, full_prompt, rag_response, intent, new_count, existing_summary = await self._prepare_turn(
+            conversation_id, user_message
+        )
+        sources_data = rag_response.sources if rag_response.sources else []
+
+        # Stream tokens while accumulating the full reply for storage
+        parts = []
+        try:
+            async for chunk in self.llm.astream(full_prompt):
+                if chunk.content:
+                    parts.append(chunk.content)
+                    yield {"type": "token", "content": chunk.content}
+        except Exception as e:
+            error_text = f"I apologize, but I encountered an error processing your request: {str(e)}"
+            parts.append(error_text)
+            yield {"type": "token", "content": error_text}
+
+        assistant_content = "".join(parts)
+        assistant_msg = await self._finalize_turn(
+            conversation_id, user_message, user_row, assistant_content,
+            sources_data, new_count, existing_summary
+        )
+
+        yield {
+            "type": "done",
+            "conversation_id": conversation_id,
+            "message": assistant_msg,
+            "sources": sources_data,
+            "intent": intent
+        }
     
     async def _generate_title(self, conversation_id: str, first_message: str):
         """Generate a title for the conversation based on first message."""
         try:
             prompt = f"Generate a short title (max 5 words) for a conversation starting with: '{first_message[:150]}'\n\nTitle:"
-            response = self.summarizer.invoke(prompt)
+            response = await self.summarizer.ainvoke(prompt)
             title = response.content.strip().strip('"\'')[:80]
             
             self.supabase.table("conversations").update({
                 "title": title
             }).eq("id", conversation_id).execute()
-        except Exception as e:
-            print(f"Title generation error: {e}")
+        except Exception:
+            logger.exception("Title generation failed")
     
     async def delete_conversation(self, conversation_id: str) -> bool:
         """Delete a conversation and its messages."""
@@ -500,6 +627,6 @@ You are an expert AI tutor helping students learn from their course materials. Y
                 "id", conversation_id
             ).execute()
             return True
-        except Exception as e:
-            print(f"Delete error: {e}")
+        except Exception:
+            logger.exception("Conversation delete failed")
             return False
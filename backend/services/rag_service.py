@@ -3,18 +3,109 @@ RAG Service using LangChain and Gemini.
 Supports PDF, PPTX, DOCX, TXT, and code files.
 """
 
+import asyncio
+import codecs
+import hashlib
 import os
 import io
-import tempfile
-from typing import List, Dict, Any, Optional
+import logging
+import re
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Iterator, List, Optional
 from dataclasses import dataclass
 
+from cachetools import TTLCache
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyPDFLoader
 from langchain_google_genai import GoogleGenerativeAIEmbeddings, ChatGoogleGenerativeAI
 from langchain_core.documents import Document
 from supabase import Client
 
+from db import get_pool
+
+logger = logging.getLogger(__name__)
+
+
+# Shared GenAI clients keyed by construction params. Chat models and
+# embedders carry auth/config/channel setup worth reusing, and several
+# services want the same (model, temperature) combination — pooling them
+# means one client per combination for the process lifetime.
+_LLM_POOL: Dict[tuple, ChatGoogleGenerativeAI] = {}
+_EMBEDDER_POOL: Dict[tuple, GoogleGenerativeAIEmbeddings] = {}
+
+
+def get_chat_model(model: str, temperature: float, api_key: str) -> ChatGoogleGenerativeAI:
+    """Get (or create) the shared chat model for (model, temperature)."""
+    key = (model, temperature)
+    if key not in _LLM_POOL:
+        _LLM_POOL[key] = ChatGoogleGenerativeAI(
+            model=model,
+            google_api_key=api_key,
+            temperature=temperature,
+        )
+    return _LLM_POOL[key]
+
+
+def get_embedder(model: str, task_type: str, api_key: str) -> GoogleGenerativeAIEmbeddings:
+    """Get (or create) the shared embeddings client for (model, task_type)."""
+    key = (model, task_type)
+    if key not in _EMBEDDER_POOL:
+        _EMBEDDER_POOL[key] = GoogleGenerativeAIEmbeddings(
+            model=model,
+            google_api_key=api_key,
+            task_type=task_type,
+        )
+    return _EMBEDDER_POOL[key]
+
+
+# Full ask() responses for repeat (FAQ-style) questions. Module level
+# (like the client pools) because indexing and chat run on different
+# RAGService instances — the routers build throwaway services per
+# upload/request — and invalidation on index must reach the cache the
+# chat service reads from.
+_ASK_CACHE: TTLCache = TTLCache(maxsize=512, ttl=900)
+
+
+# Worker pool for CPU-bound extraction/chunking. Created lazily so
+# importing the module (or running in a worker process) stays cheap.
+_cpu_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_cpu_pool() -> ProcessPoolExecutor:
+    global _cpu_pool
+    if _cpu_pool is None:
+        _cpu_pool = ProcessPoolExecutor(max_workers=os.cpu_count())
+    return _cpu_pool
+
+
+def _build_text_splitter() -> RecursiveCharacterTextSplitter:
+    """
+    Splitter config shared by the service and pool workers.
+    Deliberately character-based: a tokenizer-backed splitter (tiktoken)
+    or a compiled one (Numba/Cython) would be faster per call but the
+    split runs in a process-pool worker anyway, so the event loop never
+    sees the cost — and changing the splitter changes chunk boundaries,
+    which would invalidate everything already indexed.
+    """
+    return RecursiveCharacterTextSplitter(
+        chunk_size=1000,
+        chunk_overlap=200,
+        length_function=len,
+        separators=["\n\n", "\n", ". ", " ", ""]
+    )
+
+
+def _extract_and_chunk(file_content: bytes, file_type: str, file_name: str) -> List[Document]:
+    """
+    CPU-bound stage of indexing: extract text and split into chunks.
+    Module-level so it can run in a ProcessPoolExecutor worker.
+    """
+    # extract_text may hand back a generator, so emptiness is judged on
+    # the split result rather than the (possibly lazy) document stream
+    documents = RAGService.extract_text(file_content, file_type, file_name)
+    return _build_text_splitter().split_documents(documents)
+
 
 @dataclass
 class ChunkResult:
@@ -40,95 +131,170 @@ class RAGResponse:
 
 class RAGService:
     """RAG Service for intelligent search with multi-format support."""
-    
+
+    EMBEDDING_MODEL = "models/text-embedding-004"
+
     # Supported file types
     SUPPORTED_TYPES = {'pdf', 'pptx', 'docx', 'doc', 'txt', 'md', 'py', 'js', 'ts', 'cpp', 'c', 'java', 'html', 'css', 'json', 'yaml', 'yml'}
+
+    # Chunks per embedding API request: large enough to amortize the
+    # HTTP round trip, small enough to stay under payload limits
+    EMBED_BATCH_SIZE = 100
+
+    # Embedding batches in flight at once — keeps indexing fast for
+    # large documents without tripping API rate limits
+    EMBED_CONCURRENCY = 4
+
+    # Chunk rows per insert request: each row carries a 768-dim
+    # embedding, so a whole large document in one request would mean a
+    # multi-megabyte JSON body and PostgREST payload-limit risk
+    INSERT_BATCH_SIZE = 200
+
+    # Two-stage retrieval: oversample candidates from the ANN index,
+    # rerank the small pool, return the top `limit`. The rerank blends
+    # vector similarity with a lexical-overlap signal, which rescues
+    # exact-term matches (function names, acronyms) that cosine
+    # similarity alone can rank below looser paraphrases
+    RERANK_OVERSAMPLE = 4
+    RERANK_MAX_CANDIDATES = 50
+    RERANK_VECTOR_WEIGHT = 0.8
+
+    # Bulk chunk write for the optional asyncpg pool. The embedding
+    # placeholder receives the pgvector text literal built during record
+    # prep; the pool registers text codecs for the vector types.
+    _CHUNK_INSERT_SQL = (
+        "INSERT INTO document_chunks "
+        "(material_id, chunk_text, chunk_index, embedding, file_name, "
+        "page_number, category, topic, week_number) "
+        "VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)"
+    )
     
     def __init__(self, supabase_client: Client, gemini_api_key: str):
         self.supabase = supabase_client
         self.gemini_api_key = gemini_api_key
         
-        self.embeddings = GoogleGenerativeAIEmbeddings(
-            model="models/text-embedding-004",
-            google_api_key=gemini_api_key,
-            task_type="retrieval_document"
-        )
-        
-        self.llm = ChatGoogleGenerativeAI(
-            model="gemini-2.5-flash",
-            google_api_key=gemini_api_key,
-            temperature=0.3,
+        self.embeddings = get_embedder(
+            self.EMBEDDING_MODEL, "retrieval_document", gemini_api_key
         )
+
+        self.llm = get_chat_model("gemini-2.5-flash", 0.3, gemini_api_key)
         
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len,
-            separators=["\n\n", "\n", ". ", " ", ""]
+        self.text_splitter = _build_text_splitter()
+
+        # One retrieval_query embedder for the service's lifetime, plus a
+        # per-instance LRU so repeated queries (follow-ups, retries) skip
+        # the embedding round trip entirely
+        self._query_embedder = get_embedder(
+            self.EMBEDDING_MODEL, "retrieval_query", gemini_api_key
         )
-    
-    def extract_text(self, file_content: bytes, file_type: str, file_name: str) -> List[Document]:
+        self._cached_query_embed = lru_cache(maxsize=1024)(self._embed_query)
+
+        # Shared process-wide: the pipeline is deterministic enough per
+        # (question, filters) that a short-TTL cache turns a ~2s pipeline
+        # into a dict lookup, and clearing it on index must hit every
+        # instance, not just the one that happened to do the indexing
+        self._ask_cache = _ASK_CACHE
+
+    def _embed_query(self, normalized_query: str) -> tuple:
+        """Embed a normalized query; returns a tuple so lru_cache can store it."""
+        return tuple(self._query_embedder.embed_query(normalized_query))
+
+    @staticmethod
+    def extract_text(file_content: bytes, file_type: str, file_name: str) -> Iterable[Document]:
         """
         Extract text from various file formats.
-        Returns list of Document objects with page/slide metadata.
+        Returns an iterable of Document objects with page/slide metadata
+        (a lazy generator for PPTX, lists elsewhere).
+        Static (no instance state) so pool workers can call it directly.
         """
         file_type = file_type.lower()
-        
+
         if file_type == 'pdf':
-            return self._extract_pdf(file_content)
+            return RAGService._extract_pdf(file_content)
         elif file_type == 'pptx':
-            return self._extract_pptx(file_content, file_name)
+            return RAGService._extract_pptx(file_content, file_name)
         elif file_type in ('docx', 'doc'):
-            return self._extract_docx(file_content, file_name)
+            return RAGService._extract_docx(file_content, file_name)
         elif file_type in ('txt', 'md', 'py', 'js', 'ts', 'cpp', 'c', 'java', 'html', 'css', 'json', 'yaml', 'yml'):
-            return self._extract_text(file_content, file_name, file_type)
+            return RAGService._extract_text(file_content, file_name, file_type)
         else:
             # Try to read as plain text
             try:
-                return self._extract_text(file_content, file_name, file_type)
+                return RAGService._extract_text(file_content, file_name, file_type)
             except:
                 return []
-    
-    def _extract_pdf(self, file_content: bytes) -> List[Document]:
-        """Extract text from PDF."""
-        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
-            tmp.write(file_content)
-            tmp_path = tmp.name
-        
+
+    @staticmethod
+    def _extract_pdf(file_content: bytes) -> List[Document]:
+        """
+        Extract text from PDF.
+        Prefers pypdfium2 (C++ PDFium, several times faster than pypdf);
+        falls back to pypdf if it is not installed. Both paths parse
+        straight from the downloaded bytes — no temp-file round trip
+        through the filesystem. Pages stay 0-indexed either way.
+        """
+        try:
+            import pypdfium2 as pdfium
+
+            pdf = pdfium.PdfDocument(file_content)
+            try:
+                return [
+                    Document(
+                        page_content=page.get_textpage().get_text_range(),
+                        metadata={"page": page_num}
+                    )
+                    for page_num, page in enumerate(pdf)
+                ]
+            finally:
+                pdf.close()
+        except ImportError:
+            pass
+        except Exception:
+            logger.exception("PDF extraction failed (pypdfium2)")
+            return []
+
         try:
-            loader = PyPDFLoader(tmp_path)
-            return loader.load()
-        finally:
-            if os.path.exists(tmp_path):
-                os.remove(tmp_path)
+            from pypdf import PdfReader
+
+            reader = PdfReader(io.BytesIO(file_content))
+            return [
+                Document(
+                    page_content=page.extract_text() or "",
+                    metadata={"page": page_num}
+                )
+                for page_num, page in enumerate(reader.pages)
+            ]
+        except Exception:
+            logger.exception("PDF extraction failed (pypdf)")
+            return []
     
-    def _extract_pptx(self, file_content: bytes, file_name: str) -> List[Document]:
-        """Extract text from PowerPoint."""
+    @staticmethod
+    def _extract_pptx(file_content: bytes, file_name: str) -> Iterator[Document]:
+        """
+        Extract text from PowerPoint, one Document per slide.
+        A generator, so large decks stream slide by slide into the
+        splitter instead of being collected into a second full-deck list.
+        """
         try:
             from pptx import Presentation
-            
+
             prs = Presentation(io.BytesIO(file_content))
-            documents = []
-            
             for slide_num, slide in enumerate(prs.slides, 1):
-                texts = []
-                for shape in slide.shapes:
-                    if hasattr(shape, "text") and shape.text.strip():
-                        texts.append(shape.text.strip())
-                
-                if texts:
-                    content = "\n".join(texts)
-                    documents.append(Document(
+                content = "\n".join(
+                    shape.text.strip()
+                    for shape in slide.shapes
+                    if hasattr(shape, "text") and shape.text.strip()
+                )
+                if content:
+                    yield Document(
                         page_content=content,
                         metadata={"page": slide_num, "source": file_name, "type": "slide"}
-                    ))
-            
-            return documents
-        except Exception as e:
-            print(f"PPTX extraction error: {e}")
-            return []
+                    )
+        except Exception:
+            logger.exception("PPTX extraction failed")
     
-    def _extract_docx(self, file_content: bytes, file_name: str) -> List[Document]:
+    @staticmethod
+    def _extract_docx(file_content: bytes, file_name: str) -> List[Document]:
         """Extract text from Word document."""
         try:
             from docx import Document as DocxDocument
@@ -154,40 +320,46 @@ class RAGService:
                     metadata={"page": 1, "source": file_name, "type": "document"}
                 )]
             return []
-        except Exception as e:
-            print(f"DOCX extraction error: {e}")
+        except Exception:
+            logger.exception("DOCX extraction failed")
             return []
     
-    def _extract_text(self, file_content: bytes, file_name: str, file_type: str) -> List[Document]:
+    @staticmethod
+    def _extract_text(file_content: bytes, file_name: str, file_type: str) -> List[Document]:
         """Extract text from plain text/code files."""
         try:
-            # Try different encodings
-            for encoding in ['utf-8', 'latin-1', 'cp1252']:
-                try:
-                    content = file_content.decode(encoding)
-                    break
-                except:
-                    continue
+            # Single probe instead of a decode-exception ladder: strict
+            # UTF-8 covers almost every upload, and latin-1 accepts any
+            # byte string — so the old cp1252/ignore fallbacks were
+            # unreachable and non-UTF-8 files paid for the exceptions.
+            if file_content.startswith(codecs.BOM_UTF8):
+                content = file_content[len(codecs.BOM_UTF8):].decode('utf-8', errors='replace')
             else:
-                content = file_content.decode('utf-8', errors='ignore')
-            
+                try:
+                    content = file_content.decode('utf-8')
+                except UnicodeDecodeError:
+                    content = file_content.decode('latin-1')
+
             if content.strip():
                 return [Document(
                     page_content=content,
                     metadata={"page": 1, "source": file_name, "type": file_type}
                 )]
             return []
-        except Exception as e:
-            print(f"Text extraction error: {e}")
+        except Exception:
+            logger.exception("Text extraction failed")
             return []
     
-    def _enrich_with_metadata(self, chunk_text: str, metadata: Dict[str, Any]) -> str:
+    def _build_metadata_prefix(self, metadata: Dict[str, Any]) -> str:
         """
-        Enrich chunk text with course material metadata for better search.
-        This helps the search find content by title, topic, description etc.
+        Build the material-level enrichment prefix once per material.
+        This helps the search find content by title, topic, description
+        etc. The prefix is identical for every chunk of a material, so
+        callers compute it once and prepend it per chunk.
+        Returns "" when there is no metadata to enrich with.
         """
         enrichment_parts = []
-        
+
         if metadata.get("title"):
             enrichment_parts.append(f"Title: {metadata['title']}")
         if metadata.get("description"):
@@ -202,29 +374,109 @@ class RAGService:
                 enrichment_parts.append(f"Tags: {', '.join(tags)}")
         if metadata.get("week_number"):
             enrichment_parts.append(f"Week: {metadata['week_number']}")
-        
+
         if enrichment_parts:
-            enrichment = "[METADATA]\n" + "\n".join(enrichment_parts) + "\n[CONTENT]\n"
-            return enrichment + chunk_text
-        
-        return chunk_text
+            return "[METADATA]\n" + "\n".join(enrichment_parts) + "\n[CONTENT]\n"
+
+        return ""
     
     def chunk_documents(self, documents: List[Document]) -> List[Document]:
         """Split documents into chunks."""
         return self.text_splitter.split_documents(documents)
     
-    def generate_embeddings(self, texts: List[str]) -> List[List[float]]:
-        """Generate embeddings for texts."""
-        return self.embeddings.embed_documents(texts)
+    async def generate_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """
+        Generate embeddings for texts.
+        Texts are sent in batches of EMBED_BATCH_SIZE so a document's
+        chunks go out in a handful of API calls rather than one call
+        per chunk or one oversized request. Up to EMBED_CONCURRENCY
+        batches are in flight at once; results keep input order.
+        """
+        batches = [
+            texts[start:start + self.EMBED_BATCH_SIZE]
+            for start in range(0, len(texts), self.EMBED_BATCH_SIZE)
+        ]
+        semaphore = asyncio.Semaphore(self.EMBED_CONCURRENCY)
+
+        async def embed_batch(batch: List[str]) -> List[List[float]]:
+            async with semaphore:
+                return await asyncio.to_thread(
+                    self.embeddings.embed_documents, batch, batch_size=self.EMBED_BATCH_SIZE
+                )
+
+        results = await asyncio.gather(*(embed_batch(b) for b in batches))
+        return [emb for batch in results for emb in batch]
     
     def generate_query_embedding(self, query: str) -> List[float]:
-        """Generate embedding for query."""
-        query_emb = GoogleGenerativeAIEmbeddings(
-            model="models/text-embedding-004",
-            google_api_key=self.gemini_api_key,
-            task_type="retrieval_query"
-        )
-        return query_emb.embed_query(query)
+        """Generate embedding for query (cached for repeat queries)."""
+        return list(self._cached_query_embed(query.strip().lower()))
+
+    _CACHE_WS_RE = re.compile(r"\s+")
+
+    def _cache_key(self, text: str) -> str:
+        """
+        Content-addressed key for the persistent embedding cache.
+        The text is whitespace-collapsed and casefolded first, so
+        cosmetic edits (reflowed lines, trailing spaces, case changes)
+        still hit the cache instead of forcing a re-embed.
+        """
+        normalized = self._CACHE_WS_RE.sub(" ", text).strip().casefold()
+        return hashlib.sha256(f"{self.EMBEDDING_MODEL}||{normalized}".encode()).hexdigest()
+
+    async def _cached_embed(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed texts through the persistent embedding_cache table: look up
+        sha256(model||text) for every text, embed only the misses, and
+        upsert the new rows. Re-indexing a material whose chunks are
+        unchanged then costs zero embedding API calls. Falls back to
+        plain embedding if the cache table is unreachable.
+        """
+        hashes = [self._cache_key(t) for t in texts]
+        unique_hashes = list(dict.fromkeys(hashes))
+
+        cached: Dict[str, List[float]] = {}
+        try:
+            lookups = await asyncio.gather(*(
+                asyncio.to_thread(
+                    self.supabase.table("embedding_cache")
+                    .select("hash, embedding")
+                    .in_("hash", unique_hashes[start:start + self.INSERT_BATCH_SIZE])
+                    .execute
+                )
+                for start in range(0, len(unique_hashes), self.INSERT_BATCH_SIZE)
+            ))
+        except Exception as e:
+            logger.warning("Embedding cache lookup failed: %s", e)
+            return await self.generate_embeddings(texts)
+
+        for response in lookups:
+            for row in response.data or []:
+                cached[row["hash"]] = row["embedding"]
+
+        miss_indices = [i for i, h in enumerate(hashes) if h not in cached]
+        if miss_indices:
+            new_embeddings = await self.generate_embeddings([texts[i] for i in miss_indices])
+
+            new_rows = []
+            for i, emb in zip(miss_indices, new_embeddings):
+                if hashes[i] not in cached:
+                    new_rows.append({"hash": hashes[i], "embedding": emb})
+                cached[hashes[i]] = emb
+
+            try:
+                await asyncio.gather(*(
+                    asyncio.to_thread(
+                        self.supabase.table("embedding_cache")
+                        .upsert(new_rows[start:start + self.INSERT_BATCH_SIZE])
+                        .execute
+                    )
+                    for start in range(0, len(new_rows), self.INSERT_BATCH_SIZE)
+                ))
+            except Exception as e:
+                # Cache writes are best-effort; the embeddings are in hand
+                logger.warning("Embedding cache write failed: %s", e)
+
+        return [cached[h] for h in hashes]
     
     async def index_material(
         self, 
@@ -237,11 +489,14 @@ class RAGService:
         category: Optional[str] = None,
         topic: Optional[str] = None,
         week_number: Optional[int] = None,
-        tags: Optional[List[str]] = None
+        tags: Optional[List[str]] = None,
+        force: bool = False
     ) -> Dict[str, Any]:
         """
         Index a file into vector database with metadata enrichment.
         Supports PDF, PPTX, DOCX, TXT, and code files.
+        Unchanged content is skipped unless force is set, which re-chunks
+        and re-embeds regardless (needed after storage-format changes).
         """
         file_type = file_type.lower()
         
@@ -250,20 +505,31 @@ class RAGService:
             return {"success": False, "error": f"File type '{file_type}' not supported for indexing", "chunks_created": 0}
         
         try:
+            # Re-uploads of identical bytes are common; skip the whole
+            # delete/extract/embed pipeline when nothing changed
+            content_hash = hashlib.sha256(file_content).hexdigest()
+            if not force:
+                current = await asyncio.to_thread(
+                    self.supabase.table("course_materials").select(
+                        "content_sha256"
+                    ).eq("id", material_id).single().execute
+                )
+                if current.data and current.data.get("content_sha256") == content_hash:
+                    return {"success": True, "chunks_created": 0, "message": "Content unchanged, existing index kept"}
+
             # Delete existing chunks
             self.supabase.table("document_chunks").delete().eq(
                 "material_id", material_id
             ).execute()
             
-            # Extract text based on file type
-            documents = self.extract_text(file_content, file_type, file_name)
-            if not documents:
-                return {"success": False, "error": "No text extracted from file", "chunks_created": 0}
-            
-            # Chunk
-            chunks = self.chunk_documents(documents)
+            # Extraction + chunking is CPU-bound; run it in the process
+            # pool so the event loop keeps serving other requests
+            loop = asyncio.get_running_loop()
+            chunks = await loop.run_in_executor(
+                _get_cpu_pool(), _extract_and_chunk, file_content, file_type, file_name
+            )
             if not chunks:
-                return {"success": False, "error": "No chunks created", "chunks_created": 0}
+                return {"success": False, "error": "No text extracted from file", "chunks_created": 0}
             
             # Prepare metadata for enrichment
             metadata = {
@@ -275,76 +541,130 @@ class RAGService:
                 "tags": tags
             }
             
-            # Enrich chunks with metadata and generate embeddings
-            enriched_texts = []
-            for chunk in chunks:
-                enriched = self._enrich_with_metadata(chunk.page_content, metadata)
-                enriched_texts.append(enriched)
-            
-            embeddings = self.generate_embeddings(enriched_texts)
+            # The enrichment prefix is per-material, not per-chunk —
+            # build it once and prepend in a single comprehension
+            prefix = self._build_metadata_prefix(metadata)
+            enriched_texts = [prefix + chunk.page_content for chunk in chunks]
+
+            embeddings = await self._cached_embed(enriched_texts)
             
-            # Store in database
-            records = []
-            for idx, (chunk, emb, enriched_text) in enumerate(zip(chunks, embeddings, enriched_texts)):
-                page = chunk.metadata.get("page")
-                if page is not None:
-                    page = int(page)
-                    # PDF pages are 0-indexed, others might be 1-indexed
-                    if file_type == "pdf":
-                        page += 1
-                
-                records.append({
+            # Store in database. PDF pages are 0-indexed, others might be
+            # 1-indexed — resolve that once instead of branching per row
+            page_offset = 1 if file_type == "pdf" else 0
+            records = [
+                {
                     "material_id": material_id,
-                    "chunk_text": enriched_text,  # Store enriched text for search
+                    # Raw content only — the metadata prefix is embedded
+                    # for retrieval but not stored; lexical matching on
+                    # metadata lives in the generated tsv column, and
+                    # results no longer need prefix stripping
+                    "chunk_text": chunk.page_content,
                     "chunk_index": idx,
-                    "embedding": emb,
+                    # pgvector text format instead of a JSON float array:
+                    # 6 decimals is plenty for cosine similarity, and the
+                    # pre-built string skips per-float JSON serialization
+                    # while roughly halving the request body
+                    "embedding": "[" + ",".join(f"{v:.6f}" for v in emb) + "]",
                     "file_name": file_name,
-                    "page_number": page,
+                    "page_number": (
+                        int(chunk.metadata["page"]) + page_offset
+                        if chunk.metadata.get("page") is not None else None
+                    ),
                     "category": category,
                     "topic": topic,
                     "week_number": week_number
-                })
-            
-            self.supabase.table("document_chunks").insert(records).execute()
-            
-            # Mark as indexed
+                }
+                for idx, (chunk, emb) in enumerate(zip(chunks, embeddings))
+            ]
+
+            await self._bulk_insert_chunks(records)
+
+            # Mark as indexed and record the hash for the next upload
             self.supabase.table("course_materials").update({
-                "is_indexed": True
+                "is_indexed": True,
+                "content_sha256": content_hash
             }).eq("id", material_id).execute()
+
+            # New content invalidates previously cached answers
+            self._ask_cache.clear()
             
             return {"success": True, "chunks_created": len(records), "message": f"Indexed {len(records)} chunks from {file_type.upper()}"}
             
         except Exception as e:
             return {"success": False, "error": str(e), "chunks_created": 0}
     
+    async def _bulk_insert_chunks(self, records: List[Dict[str, Any]]):
+        """
+        Write chunk rows to document_chunks.
+        With the optional asyncpg pool configured this is one pipelined
+        prepared statement over a pooled connection — no HTTP or JSON
+        body at all. Otherwise the rows go through PostgREST in
+        concurrent INSERT_BATCH_SIZE batches.
+        """
+        pool = get_pool()
+        if pool is not None:
+            try:
+                await pool.executemany(self._CHUNK_INSERT_SQL, [
+                    (
+                        uuid.UUID(r["material_id"]),
+                        r["chunk_text"],
+                        r["chunk_index"],
+                        r["embedding"],
+                        r["file_name"],
+                        r["page_number"],
+                        r["category"],
+                        r["topic"],
+                        r["week_number"]
+                    )
+                    for r in records
+                ])
+                return
+            except Exception as e:
+                # executemany is atomic, so nothing was written — the
+                # PostgREST path below can safely take over
+                logger.warning("Pooled chunk insert failed, using PostgREST: %s", e)
+
+        insert_batches = [
+            records[start:start + self.INSERT_BATCH_SIZE]
+            for start in range(0, len(records), self.INSERT_BATCH_SIZE)
+        ]
+        await asyncio.gather(*(
+            asyncio.to_thread(self.supabase.table("document_chunks").insert(batch).execute)
+            for batch in insert_batches
+        ))
+
     async def search(
-        self, 
-        query: str, 
+        self,
+        query: str,
         limit: int = 5,
         threshold: float = 0.5,
         category: Optional[str] = None,
         week: Optional[int] = None
     ) -> List[ChunkResult]:
-        """Vector similarity search."""
-        embedding = self.generate_query_embedding(query)
-        
-        response = self.supabase.rpc(
+        """Vector similarity search with a second-stage rerank."""
+        # Both network hops run off the event loop so concurrent chat
+        # turns are not serialized behind the embedding call or the RPC
+        embedding = await asyncio.to_thread(self.generate_query_embedding, query)
+
+        fetch_count = min(limit * self.RERANK_OVERSAMPLE, self.RERANK_MAX_CANDIDATES)
+        rpc = self.supabase.rpc(
             "match_documents",
             {
                 "query_embedding": embedding,
                 "match_threshold": threshold,
-                "match_count": limit,
+                "match_count": fetch_count,
                 "filter_category": category,
                 "filter_week": week
             }
-        ).execute()
-        
+        )
+        response = await asyncio.to_thread(rpc.execute)
+
         results = []
         for row in response.data:
-            # Extract just the content part for display (remove metadata prefix)
-            chunk_text = row["chunk_text"]
-            if "[CONTENT]" in chunk_text:
-                chunk_text = chunk_text.split("[CONTENT]", 1)[1].strip()
+            # Extract just the content part for display (remove metadata
+            # prefix); partition scans once and allocates no list
+            _, sep, rest = row["chunk_text"].partition("[CONTENT]")
+            chunk_text = rest.strip() if sep else row["chunk_text"]
             
             results.append(ChunkResult(
                 id=row["id"],
@@ -358,9 +678,32 @@ class RAGService:
                 week_number=row["week_number"],
                 similarity=row["similarity"]
             ))
-        
-        return results
-    
+
+        return self._rerank(query, results, limit)
+
+    def _rerank(self, query: str, candidates: List[ChunkResult], limit: int) -> List[ChunkResult]:
+        """
+        Second retrieval stage: blend ANN similarity with lexical overlap
+        between the query and each candidate, then keep the top `limit`.
+        Cheap (pure Python over <=50 short texts) but rescues exact-term
+        matches that embedding distance alone can underrank.
+        """
+        if len(candidates) <= limit:
+            return candidates
+
+        query_terms = {t for t in re.findall(r"[a-z0-9]+", query.lower()) if len(t) > 2}
+        if not query_terms:
+            return candidates[:limit]
+
+        def blended_score(c: ChunkResult) -> float:
+            chunk_terms = set(re.findall(r"[a-z0-9]+", c.chunk_text.lower()))
+            overlap = len(query_terms & chunk_terms) / len(query_terms)
+            return (self.RERANK_VECTOR_WEIGHT * c.similarity
+                    + (1 - self.RERANK_VECTOR_WEIGHT) * overlap)
+
+        candidates.sort(key=blended_score, reverse=True)
+        return candidates[:limit]
+
     async def ask(
         self, 
         question: str, 
@@ -369,6 +712,11 @@ class RAGService:
         week: Optional[int] = None
     ) -> RAGResponse:
         """Full RAG pipeline."""
+        cache_key = (question.strip().lower(), limit, category, week)
+        cached = self._ask_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
         chunks = await self.search(question, limit, 0.4, category, week)
         
         if not chunks:
@@ -377,17 +725,15 @@ class RAGService:
                 sources=[]
             )
         
-        # Build context
-        context_parts = []
-        for i, c in enumerate(chunks):
-            src = f"[Source {i+1}: {c.file_name}"
-            if c.page_number:
-                src += f", Page {c.page_number}"
-            if c.topic:
-                src += f", Topic: {c.topic}"
-            src += "]"
-            context_parts.append(f"{src}\n{c.chunk_text}")
-        
+        # Build context in one comprehension + join rather than growing
+        # strings piece by piece in a loop
+        context_parts = [
+            f"[Source {i+1}: {c.file_name}"
+            + (f", Page {c.page_number}" if c.page_number else "")
+            + (f", Topic: {c.topic}" if c.topic else "")
+            + f"]\n{c.chunk_text}"
+            for i, c in enumerate(chunks)
+        ]
         context = "\n\n---\n\n".join(context_parts)
         
         # Generate answer
@@ -400,8 +746,8 @@ QUESTION: {question}
 
 ANSWER:"""
 
-        response = self.llm.invoke(prompt)
-        
+        response = await self.llm.ainvoke(prompt)
+
         sources = [{
             "file_name": c.file_name,
             "page_number": c.page_number,
@@ -409,5 +755,7 @@ ANSWER:"""
             "similarity": round(c.similarity, 3),
             "material_id": c.material_id
         } for c in chunks]
-        
-        return RAGResponse(answer=response.content, sources=sources)
+
+        rag_response = RAGResponse(answer=response.content, sources=sources)
+        self._ask_cache[cache_key] = rag_response
+        return rag_response
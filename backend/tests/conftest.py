@@ -0,0 +1,34 @@
+"""
+Shared fixtures for backend tests.
+Supabase clients are session-scoped so a test run builds each client
+(and its HTTP session) once, and env-gated so CI without credentials
+skips the connectivity tests instead of failing.
+"""
+
+import os
+
+import pytest
+from dotenv import load_dotenv
+from supabase import Client, create_client
+
+load_dotenv()
+
+
+@pytest.fixture(scope="session")
+def supabase_service() -> Client:
+    """Service-role client; skips if credentials are not configured."""
+    url = os.getenv("SUPABASE_URL")
+    key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+    if not url or not key:
+        pytest.skip("SUPABASE_URL / SUPABASE_SERVICE_ROLE_KEY not configured")
+    return create_client(url, key)
+
+
+@pytest.fixture(scope="session")
+def supabase_anon() -> Client:
+    """Anon-key client; skips if credentials are not configured."""
+    url = os.getenv("SUPABASE_URL")
+    key = os.getenv("SUPABASE_ANON_KEY")
+    if not url or not key:
+        pytest.skip("SUPABASE_URL / SUPABASE_ANON_KEY not configured")
+    return create_client(url, key)
@@ -0,0 +1,55 @@
+-- ============================================
+-- Single Round-Trip Auth Lookup
+-- Verifies a JWT and returns the joined profile
+-- in one RPC call (replaces auth.get_user +
+-- profiles select in the backend).
+-- Run this in Supabase SQL Editor
+-- ============================================
+
+-- pgjwt provides extensions.verify() for JWT signature checks
+CREATE EXTENSION IF NOT EXISTS pgjwt WITH SCHEMA extensions;
+
+CREATE OR REPLACE FUNCTION get_user_with_profile(jwt text)
+RETURNS json
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public, extensions
+AS $$
+DECLARE
+  verified record;
+  token_payload json;
+  token_user_id uuid;
+BEGIN
+  -- Verify signature against the project JWT secret
+  SELECT * INTO verified
+  FROM extensions.verify(jwt, current_setting('app.settings.jwt_secret', true));
+
+  IF verified IS NULL OR NOT verified.valid THEN
+    RETURN NULL;
+  END IF;
+
+  token_payload := verified.payload::json;
+
+  -- Reject expired tokens
+  IF (token_payload->>'exp')::numeric < extract(epoch FROM now()) THEN
+    RETURN NULL;
+  END IF;
+
+  token_user_id := (token_payload->>'sub')::uuid;
+
+  RETURN (
+    SELECT json_build_object(
+      'id', u.id,
+      'email', COALESCE(token_payload->>'email', u.email),
+      'role', COALESCE(p.role, 'student')
+    )
+    FROM auth.users u
+    LEFT JOIN public.profiles p ON p.id = u.id
+    WHERE u.id = token_user_id
+  );
+END;
+$$;
+
+-- Only the backend (service role) should call this
+REVOKE EXECUTE ON FUNCTION get_user_with_profile(text) FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION get_user_with_profile(text) TO service_role;
@@ -0,0 +1,32 @@
+-- ============================================
+-- Role Claim Sync
+-- Mirrors profiles.role into auth.users
+-- raw_app_meta_data so freshly issued JWTs carry
+-- the role claim and the backend can authorize
+-- without any database call.
+-- Run this in Supabase SQL Editor
+-- ============================================
+
+CREATE OR REPLACE FUNCTION public.sync_role_claim()
+RETURNS TRIGGER AS $$
+BEGIN
+  UPDATE auth.users
+  SET raw_app_meta_data =
+    COALESCE(raw_app_meta_data, '{}'::jsonb) || jsonb_build_object('role', NEW.role)
+  WHERE id = NEW.id;
+
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+DROP TRIGGER IF EXISTS on_profile_role_change ON public.profiles;
+CREATE TRIGGER on_profile_role_change
+  AFTER INSERT OR UPDATE OF role ON public.profiles
+  FOR EACH ROW EXECUTE FUNCTION public.sync_role_claim();
+
+-- Backfill existing users so their next token refresh picks up the claim
+UPDATE auth.users u
+SET raw_app_meta_data =
+  COALESCE(u.raw_app_meta_data, '{}'::jsonb) || jsonb_build_object('role', p.role)
+FROM public.profiles p
+WHERE p.id = u.id;
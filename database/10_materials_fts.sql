@@ -0,0 +1,15 @@
+-- ============================================
+-- Full-Text Search for Course Materials
+-- Replaces the double ILIKE search in the list
+-- endpoint with an indexed tsvector lookup.
+-- Run this in Supabase SQL Editor
+-- ============================================
+
+ALTER TABLE public.course_materials
+  ADD COLUMN IF NOT EXISTS search_tsv tsvector
+  GENERATED ALWAYS AS (
+    to_tsvector('english', coalesce(title, '') || ' ' || coalesce(description, ''))
+  ) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_materials_search_tsv
+  ON public.course_materials USING GIN (search_tsv);
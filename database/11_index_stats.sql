@@ -0,0 +1,23 @@
+-- ============================================
+-- Index Statistics Function
+-- Returns all three counts the /index-status
+-- endpoint needs in a single query instead of
+-- three separate count round trips.
+-- Run this in Supabase SQL Editor
+-- ============================================
+
+CREATE OR REPLACE FUNCTION index_stats()
+RETURNS TABLE (
+  total_materials bigint,
+  indexed_materials bigint,
+  total_chunks bigint
+)
+LANGUAGE sql
+STABLE
+AS $$
+  SELECT
+    COUNT(*),
+    COUNT(*) FILTER (WHERE is_indexed),
+    (SELECT COUNT(*) FROM public.document_chunks)
+  FROM public.course_materials;
+$$;
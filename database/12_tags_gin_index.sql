@@ -0,0 +1,10 @@
+-- ============================================
+-- GIN Index for Tag Filtering
+-- Lets the tags @> ARRAY[...] containment
+-- filter in the list endpoint use an index
+-- lookup instead of scanning rows.
+-- Run this in Supabase SQL Editor
+-- ============================================
+
+CREATE INDEX IF NOT EXISTS idx_materials_tags
+  ON public.course_materials USING GIN (tags);
@@ -0,0 +1,24 @@
+-- ============================================
+-- Atomic Conversation Counter
+-- Bumps message_count and returns the updated
+-- count plus the rolling summary in one round
+-- trip, replacing the racy SELECT + UPDATE
+-- pair the chat path used before.
+-- Run this in Supabase SQL Editor
+-- ============================================
+
+CREATE OR REPLACE FUNCTION increment_and_fetch_conv(
+  p_id uuid,
+  p_delta int DEFAULT 2
+)
+RETURNS TABLE (
+  message_count int,
+  rolling_summary text
+)
+LANGUAGE sql
+AS $$
+  UPDATE public.conversations
+  SET message_count = conversations.message_count + p_delta
+  WHERE id = p_id
+  RETURNING conversations.message_count, conversations.rolling_summary;
+$$;
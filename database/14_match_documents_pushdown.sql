@@ -0,0 +1,68 @@
+-- ============================================
+-- match_documents: ANN-first Candidate Scan
+-- Restructures the search function so the HNSW
+-- index drives the scan: the inner query pulls
+-- an oversampled candidate set ordered by
+-- distance, and the similarity threshold is
+-- applied afterwards instead of forcing a
+-- filtered full scan. Also adds the missing
+-- btree index for the week filter.
+-- Run this in Supabase SQL Editor
+-- ============================================
+
+CREATE INDEX IF NOT EXISTS idx_chunks_week_number
+  ON public.document_chunks(week_number);
+
+CREATE OR REPLACE FUNCTION match_documents(
+  query_embedding vector(768),
+  match_threshold float DEFAULT 0.5,
+  match_count int DEFAULT 5,
+  filter_category text DEFAULT NULL,
+  filter_week int DEFAULT NULL
+)
+RETURNS TABLE (
+  id uuid,
+  material_id uuid,
+  chunk_text text,
+  chunk_index int,
+  file_name text,
+  page_number int,
+  category text,
+  topic text,
+  week_number int,
+  similarity float
+)
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  -- Widen the HNSW candidate pool for this query so rows dropped by
+  -- the metadata/threshold filters still leave match_count results
+  PERFORM set_config('hnsw.ef_search', '40', true);
+
+  RETURN QUERY
+  SELECT *
+  FROM (
+    SELECT
+      dc.id,
+      dc.material_id,
+      dc.chunk_text,
+      dc.chunk_index,
+      dc.file_name,
+      dc.page_number,
+      dc.category,
+      dc.topic,
+      dc.week_number,
+      1 - (dc.embedding <=> query_embedding) AS similarity
+    FROM public.document_chunks dc
+    WHERE
+      dc.embedding IS NOT NULL
+      AND (filter_category IS NULL OR dc.category = filter_category)
+      AND (filter_week IS NULL OR dc.week_number = filter_week)
+    ORDER BY dc.embedding <=> query_embedding
+    LIMIT GREATEST(match_count * 4, 20)
+  ) candidates
+  WHERE candidates.similarity > match_threshold
+  ORDER BY candidates.similarity DESC
+  LIMIT match_count;
+END;
+$$;
@@ -0,0 +1,74 @@
+-- ============================================
+-- Half-Precision Chunk Embeddings
+-- Stores embeddings as halfvec (FP16), halving
+-- row size and the bytes touched per distance
+-- computation; recall loss at 768 dims is
+-- negligible. Requires pgvector >= 0.7.
+-- Clients keep sending plain float lists — the
+-- column input cast handles the conversion.
+-- Run this in Supabase SQL Editor
+-- ============================================
+
+DROP INDEX IF EXISTS idx_chunks_embedding;
+
+ALTER TABLE public.document_chunks
+  ALTER COLUMN embedding TYPE halfvec(768);
+
+CREATE INDEX idx_chunks_embedding
+  ON public.document_chunks USING hnsw (embedding halfvec_cosine_ops);
+
+-- Same shape as 14_match_documents_pushdown.sql; the query embedding is
+-- cast to halfvec once so distances run entirely in FP16
+CREATE OR REPLACE FUNCTION match_documents(
+  query_embedding vector(768),
+  match_threshold float DEFAULT 0.5,
+  match_count int DEFAULT 5,
+  filter_category text DEFAULT NULL,
+  filter_week int DEFAULT NULL
+)
+RETURNS TABLE (
+  id uuid,
+  material_id uuid,
+  chunk_text text,
+  chunk_index int,
+  file_name text,
+  page_number int,
+  category text,
+  topic text,
+  week_number int,
+  similarity float
+)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  q halfvec(768) := query_embedding::halfvec(768);
+BEGIN
+  PERFORM set_config('hnsw.ef_search', '40', true);
+
+  RETURN QUERY
+  SELECT *
+  FROM (
+    SELECT
+      dc.id,
+      dc.material_id,
+      dc.chunk_text,
+      dc.chunk_index,
+      dc.file_name,
+      dc.page_number,
+      dc.category,
+      dc.topic,
+      dc.week_number,
+      1 - (dc.embedding <=> q) AS similarity
+    FROM public.document_chunks dc
+    WHERE
+      dc.embedding IS NOT NULL
+      AND (filter_category IS NULL OR dc.category = filter_category)
+      AND (filter_week IS NULL OR dc.week_number = filter_week)
+    ORDER BY dc.embedding <=> q
+    LIMIT GREATEST(match_count * 4, 20)
+  ) candidates
+  WHERE candidates.similarity > match_threshold
+  ORDER BY candidates.similarity DESC
+  LIMIT match_count;
+END;
+$$;
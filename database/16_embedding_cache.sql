@@ -0,0 +1,23 @@
+-- ============================================
+-- Content-Addressed Embedding Cache
+-- Stores one embedding per sha256(model||text)
+-- so re-indexing unchanged chunks skips the
+-- Gemini embedding API entirely. Written and
+-- read only by the backend service role.
+-- Run this in Supabase SQL Editor
+-- ============================================
+
+CREATE TABLE IF NOT EXISTS public.embedding_cache (
+  hash TEXT PRIMARY KEY,
+  embedding JSONB NOT NULL,
+  created_at TIMESTAMPTZ DEFAULT NOW()
+);
+
+ALTER TABLE public.embedding_cache ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Service role can manage embedding cache"
+  ON public.embedding_cache FOR ALL
+  TO service_role
+  USING (true);
+
+GRANT ALL ON public.embedding_cache TO service_role;
@@ -0,0 +1,84 @@
+-- ============================================
+-- Lexical Index for Chunks
+-- Chunk rows now store raw content (the backend
+-- stopped prepending the [METADATA] block), and
+-- the lexical signal moves into a generated
+-- tsvector over the metadata columns + text,
+-- with an optional full-text AND-filter in
+-- match_documents for hybrid retrieval.
+-- Run this in Supabase SQL Editor
+-- ============================================
+
+ALTER TABLE public.document_chunks
+  ADD COLUMN IF NOT EXISTS tsv tsvector
+  GENERATED ALWAYS AS (
+    to_tsvector('english',
+      coalesce(topic, '') || ' ' ||
+      coalesce(category, '') || ' ' ||
+      coalesce(file_name, '') || ' ' ||
+      chunk_text)
+  ) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_chunks_tsv
+  ON public.document_chunks USING GIN (tsv);
+
+-- Replace (not overload) the search function: same body as migration
+-- 15 plus an optional lexical filter applied inside the candidate scan
+DROP FUNCTION IF EXISTS match_documents(vector, float, int, text, int);
+
+CREATE OR REPLACE FUNCTION match_documents(
+  query_embedding vector(768),
+  match_threshold float DEFAULT 0.5,
+  match_count int DEFAULT 5,
+  filter_category text DEFAULT NULL,
+  filter_week int DEFAULT NULL,
+  filter_query text DEFAULT NULL
+)
+RETURNS TABLE (
+  id uuid,
+  material_id uuid,
+  chunk_text text,
+  chunk_index int,
+  file_name text,
+  page_number int,
+  category text,
+  topic text,
+  week_number int,
+  similarity float
+)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  q halfvec(768) := query_embedding::halfvec(768);
+BEGIN
+  PERFORM set_config('hnsw.ef_search', '40', true);
+
+  RETURN QUERY
+  SELECT *
+  FROM (
+    SELECT
+      dc.id,
+      dc.material_id,
+      dc.chunk_text,
+      dc.chunk_index,
+      dc.file_name,
+      dc.page_number,
+      dc.category,
+      dc.topic,
+      dc.week_number,
+      1 - (dc.embedding <=> q) AS similarity
+    FROM public.document_chunks dc
+    WHERE
+      dc.embedding IS NOT NULL
+      AND (filter_category IS NULL OR dc.category = filter_category)
+      AND (filter_week IS NULL OR dc.week_number = filter_week)
+      AND (filter_query IS NULL
+           OR dc.tsv @@ plainto_tsquery('english', filter_query))
+    ORDER BY dc.embedding <=> q
+    LIMIT GREATEST(match_count * 4, 20)
+  ) candidates
+  WHERE candidates.similarity > match_threshold
+  ORDER BY candidates.similarity DESC
+  LIMIT match_count;
+END;
+$$;
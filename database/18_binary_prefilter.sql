@@ -0,0 +1,80 @@
+-- ============================================
+-- Binary-Quantized Prefilter for Chunk Search
+-- Adds a bit(768) generated column (sign of each
+-- embedding dimension) with a Hamming-distance
+-- HNSW index. match_documents now gathers an
+-- oversampled candidate set on the cheap bit
+-- index, then reranks the survivors with exact
+-- halfvec cosine distance. Requires pgvector 0.7+.
+-- Run this in Supabase SQL Editor
+-- ============================================
+
+ALTER TABLE public.document_chunks
+  ADD COLUMN IF NOT EXISTS embedding_bit bit(768)
+  GENERATED ALWAYS AS (binary_quantize(embedding)) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_chunks_embedding_bit
+  ON public.document_chunks
+  USING hnsw (embedding_bit bit_hamming_ops);
+
+-- Same signature and filters as migration 17; only the candidate
+-- stage changes from halfvec cosine to bit Hamming distance
+CREATE OR REPLACE FUNCTION match_documents(
+  query_embedding vector(768),
+  match_threshold float DEFAULT 0.5,
+  match_count int DEFAULT 5,
+  filter_category text DEFAULT NULL,
+  filter_week int DEFAULT NULL,
+  filter_query text DEFAULT NULL
+)
+RETURNS TABLE (
+  id uuid,
+  material_id uuid,
+  chunk_text text,
+  chunk_index int,
+  file_name text,
+  page_number int,
+  category text,
+  topic text,
+  week_number int,
+  similarity float
+)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  q halfvec(768) := query_embedding::halfvec(768);
+  q_bit bit(768) := binary_quantize(query_embedding);
+BEGIN
+  PERFORM set_config('hnsw.ef_search', '100', true);
+
+  RETURN QUERY
+  SELECT *
+  FROM (
+    SELECT
+      dc.id,
+      dc.material_id,
+      dc.chunk_text,
+      dc.chunk_index,
+      dc.file_name,
+      dc.page_number,
+      dc.category,
+      dc.topic,
+      dc.week_number,
+      1 - (dc.embedding <=> q) AS similarity
+    FROM public.document_chunks dc
+    WHERE
+      dc.embedding IS NOT NULL
+      AND (filter_category IS NULL OR dc.category = filter_category)
+      AND (filter_week IS NULL OR dc.week_number = filter_week)
+      AND (filter_query IS NULL
+           OR dc.tsv @@ plainto_tsquery('english', filter_query))
+    -- Oversample harder than the halfvec scan did: Hamming order is a
+    -- coarse proxy for cosine, so the exact rerank needs more slack
+    ORDER BY dc.embedding_bit <~> q_bit
+    LIMIT GREATEST(match_count * 10, 40)
+  ) candidates
+  WHERE candidates.similarity > match_threshold
+  ORDER BY candidates.similarity DESC
+  LIMIT match_count;
+END;
+$$;
@@ -0,0 +1,10 @@
+-- ============================================
+-- Content Hash for Course Materials
+-- index_material stores sha256(file bytes) here
+-- and skips re-extraction/re-embedding entirely
+-- when the same file is uploaded again.
+-- Run this in Supabase SQL Editor
+-- ============================================
+
+ALTER TABLE public.course_materials
+  ADD COLUMN IF NOT EXISTS content_sha256 TEXT;